@@ -24,48 +24,62 @@
 
 from .class_system import Class
 from . import parser
-from .function import Function
+from .function import Function, MemoCache
 from . import lexer
+from . import native
 
 class BuiltinFunctions:
     """ Builtin functions """
     def run_endfunc(self, op: dict):
         """ Closes the functon declaration block """
         if self.current_func:
+            if self.current_class:
+                func = self.classes[self.current_class[-1]].__methods__[self.current_func[-1]]
+            else:
+                func = self.functions[self.current_func[-1]]
+            func.make_slots()
+            func.make_binder()
             self.current_func.pop()
         else:
             self.raise_error('SyntaxError', 'unexpected "endfunc" when function block is not opened', op)
 
     def run_goto(self, op: dict):
         """ Changes program current step to a specify label """
-        self.require_one_argument(op, 'goto function requires label name argument')
-        arg = op['args'][0]
-        try:
-            label_index = self.labels[arg]
-        except KeyError:
-            return self.raise_error('LabelError', 'undefined label "' + str(arg) + '"', op)
-        self.frames[-1]['current_step'] = label_index-1
+        node = op['node']
+        if node.label is None:
+            return self.require_one_argument(op, 'goto function requires label name argument')
+        if node.offset is None:
+            return self.raise_error('LabelError', 'undefined label "' + str(node.label) + '"', op)
+        self.frames[-1].current_step += node.offset
 
     def run_gotoif(self, op: dict):
         """ Changes program current step to a specify label IF mem is True """
-        self.require_one_argument(op, 'gotoif function requires label name argument')
-        arg = op['args'][0]
-        try:
-            label_index = self.labels[arg]
-        except KeyError:
-            return self.raise_error('LabelError', 'undefined label "' + str(arg) + '"', op)
+        node = op['node']
+        if node.label is None:
+            return self.require_one_argument(op, 'gotoif function requires label name argument')
+        if node.offset is None:
+            return self.raise_error('LabelError', 'undefined label "' + str(node.label) + '"', op)
         if self.mem:
-            self.frames[-1]['current_step'] = label_index-1
+            self.frames[-1].current_step += node.offset
+
+    def run_branch(self, op: dict):
+        """ Runs the fused `mem not (<condition>)` and `gotoif <label>` of the `if` blocks """
+        node = op['node']
+        self.mem = self.eval(node.condition)
+        if self.mem:
+            if node.offset is None:
+                return self.raise_error('LabelError', 'undefined label "' + str(node.label) + '"', op)
+            self.frames[-1].current_step += node.offset
 
     def run_try(self, op: dict):
         """ Starts the try-endtry block """
-        self.require_one_argument(op, 'try command requires label name argument')
-        arg = op['args'][0]
-        try:
-            self.labels[arg]
-        except KeyError:
-            return self.raise_error('LabelError', 'undefined label "' + str(arg) + '"', op)
-        self.try_endtry.append(arg)
+        node = op['node']
+        if node.label is None:
+            return self.require_one_argument(op, 'try command requires label name argument')
+        if node.offset is None:
+            return self.raise_error('LabelError', 'undefined label "' + str(node.label) + '"', op)
+        frame = self.frames[-1]
+        self.try_endtry.append((frame, frame.current_step + node.offset))
 
     def run_endtry(self, op: dict):
         """ Closes the try-endtry block """
@@ -84,6 +98,7 @@ class BuiltinFunctions:
                     'SyntaxError', 'unexpected "' + ch + '"', op
                 )
         self.namespaces_tree.append(arg)
+        self.reset_var_keys()
 
     def run_endnamespace(self, op: dict):
         """ Closes the namespace block """
@@ -104,6 +119,7 @@ class BuiltinFunctions:
                 pass
 
             self.namespaces_tree.pop()
+            self.reset_var_keys()
         else:
             self.raise_error('SyntaxError', 'unexpected "endnamespace" when namespace block is not opened', op)
 
@@ -111,12 +127,13 @@ class BuiltinFunctions:
         """ Adds a namespace to used namespaces """
         self.require_one_argument(op, 'use command requires namespace argument')
         arg = op['args'][0]
-        self.frames[-1]['used_namespaces'].append(arg)
+        self.frames[-1].used_namespaces.append(arg)
+        self.reset_var_keys()
 
     def run_endclass(self, op: dict):
         """ Closes the class declaration block """
         if self.current_class:
-            self.current_class.pop()
+            self.classes[self.current_class.pop()].make_lookup(self)
         else:
             self.raise_error('SyntaxError', 'unexpected "endclass" when class block is not opened', op)
 
@@ -149,7 +166,7 @@ class BuiltinFunctions:
                 parent_real_name = self.current_namespace() + parent
             except KeyError:
                 parent_obj = None
-                for used_namespace in self.frames[-1]['used_namespaces']:
+                for used_namespace in self.frames[-1].used_namespaces:
                     try:
                         parent_obj = self.classes[used_namespace + '.' + parent]
                         parent_real_name = used_namespace + '.' + parent
@@ -230,14 +247,18 @@ class BuiltinFunctions:
             self.classes[self.current_class[-1]].__methods__[self.current_func[-1]] = Function(name=self.current_func[-1])
             self.classes[self.current_class[-1]].__methods__[self.current_func[-1]].__docstring__ = self.last_docstring
             self.classes[self.current_class[-1]].__methods__[self.current_func[-1]].return_type = return_type
+            self.classes[self.current_class[-1]].__methods__[self.current_func[-1]].memo = self.last_memo
             self.last_docstring = ''
+            self.last_memo = None
             is_method = True
         else:
             self.current_func.append(self.current_namespace() + arg)
             self.functions[self.current_func[-1]] = Function(name=self.current_func[-1])
             self.functions[self.current_func[-1]].__docstring__ = self.last_docstring
             self.functions[self.current_func[-1]].return_type = return_type
+            self.functions[self.current_func[-1]].memo = self.last_memo
             self.last_docstring = ''
+            self.last_memo = None
         # check for argument variable
         if len(op['args_str'].split('(', 1)) > 1:
             arg_var = op['args_str'].split('(', 1)[-1].strip()
@@ -279,64 +300,74 @@ class BuiltinFunctions:
 
     def run_return(self, op: dict):
         """ Returns a value in function """
-        value = op['args_str'].strip()
-        if value == '':
-            value = None
-        else:
-            value = self.eval(op['args_eval'])
+        value = op['node'].value
+        if value is not None:
+            value = self.eval(value)
+        self.return_frame(value)
+
+    def return_frame(self, value):
+        """ Finishes the current frame with the returned value (exits the program in the main frame) """
         self.mem = value
         if len(self.frames) > 1:
-            self.frames[-1]['current_step'] = len(self.frames[-1]['commands']) * 2
+            self.frames[-1].current_step = len(self.frames[-1].commands) * 2
         else:
             self.exit_program(value)
 
     def run_while(self, op: dict):
         """ The while block start """
-        condition_result = self.eval(op['args_eval'])
-        if condition_result:
+        node = op['node']
+        if self.eval(node.condition):
             return
         # condition is not True, loop should be breaked
-        i = self.frames[-1]['current_step']+1
-        loop_depth = 0
-        while i < len(self.frames[-1]['commands']):
-            if self.frames[-1]['commands'][i]['command'] == 'while':
-                loop_depth += 1
-            elif self.frames[-1]['commands'][i]['command'] == 'endwhile':
-                if loop_depth > 0:
-                    loop_depth -= 1
-                else:
-                    self.frames[-1]['current_step'] = i
-                    return
-            i += 1
+        if node.end is not None:
+            self.frames[-1].current_step += node.end
 
     def run_endwhile(self, op: dict):
         """ The While block end """
         # Back to first of loop
-        i = self.frames[-1]['current_step']-1
-        loop_depth = 0
-        while i >= 0:
-            if self.frames[-1]['commands'][i]['command'] == 'endwhile':
-                loop_depth += 1
-            elif self.frames[-1]['commands'][i]['command'] == 'while':
-                if loop_depth > 0:
-                    loop_depth -=1
-                else:
-                    self.frames[-1]['current_step'] = i-1
-                    return
-            i -= 1
+        start = op['node'].start
+        if start is not None:
+            frame = self.frames[-1]
+            frame.current_step += start - 1
+            if frame.vars is self.frames[0].vars and not self.namespaces_tree and not self.current_class:
+                # hot loops of the main code are run by the native tier
+                loop = native.get_native_loop(self, op, frame)
+                if loop is not None:
+                    loop(self, frame, frame.commands)
 
     def run_break(self, op: dict):
         """ Breaks the loop """
-        tmp_op = dict(op)
-        op['args_str'] = 'False'
-        op['args_eval'] = [['n', 'False']]
-        self.run_while(op)
+        end = op['node'].end
+        if end is not None:
+            self.frames[-1].current_step += end
 
     def run_continue(self, op: dict):
         """ Continues the loop """
-        self.run_endwhile(op)
+        start = op['node'].start
+        if start is not None:
+            self.frames[-1].current_step += start - 1
 
     def run_atdoc(self, op: dict):
         """ @doc sets last docstring """
         docstr = str(self.eval(op['args_eval'])).strip()
         self.last_docstring = docstr
+
+    def run_atmemo(self, op: dict):
+        """ @memo makes the next declared function memoized
+
+        Arguments are the maximum count of the cached results and the seconds that a result is kept (`@memo 1000, 60`),
+        null means no limit.
+        """
+        args = ()
+        if op['args_str'].strip() != '':
+            args = self.eval(op['args_eval'])
+            if type(args) != tuple:
+                args = (args,)
+        if len(args) > 2:
+            return self.raise_error('ArgumentError', '@memo gets at most 2 arguments (size and ttl), ' + str(len(args)) + ' given', op)
+        for value in args:
+            if value is not None and (type(value) not in (int, float) or value <= 0):
+                return self.raise_error('ArgumentError', 'size and ttl of @memo should be positive numbers or null, ' + repr(value) + ' given', op)
+        if args and args[0] is not None and type(args[0]) != int:
+            return self.raise_error('ArgumentError', 'size of @memo should be integer, ' + repr(args[0]) + ' given', op)
+        self.last_memo = MemoCache(*args)
@@ -23,7 +23,40 @@
 """ Classes """
 
 import copy
-from .function import Function
+from .function import Function, BoundMethod
+
+IMMUTABLE_TYPES = (bool, int, float, complex, str, bytes, type(None))
+""" Types of the property values that are not copied for each object """
+
+def copy_props(props: dict, memo: dict) -> dict:
+    """ Copies the properties of a class for a new object
+
+    The immutable values are shared and only the other values are deep-copied
+    (`memo` is shared between the levels of the inheritance tree, like a single `copy.deepcopy`).
+    """
+    result = dict(props)
+    for key, value in result.items():
+        if type(value) not in IMMUTABLE_TYPES:
+            result[key] = copy.deepcopy(value, memo)
+    return result
+
+def make_lookup(props: list, methods: list) -> tuple:
+    """ Makes the lookup tables of the objects of a class
+
+    Args:
+        props(list): props dicts of the classes in the inheritance tree
+        methods(list): methods dicts of the classes in the inheritance tree
+
+    Return:
+        tuple: (<prop name: index of the last class that has the prop>, <method name: method of the last class that has it>)
+    """
+    prop_levels = {}
+    method_table = {}
+    for level in range(len(props)):
+        for key in props[level]:
+            prop_levels[key] = level
+        method_table.update(methods[level])
+    return prop_levels, method_table
 
 class ClassConstError(Exception):
     """ Will be raised when changing a const property """
@@ -41,46 +74,69 @@ class Class:
         self.__inheritance_tree__ = []
         self.__traits__ = []
         self.__classname__ = name
+        self.__lookup__ = None
 
     def __str__(self):
         return "<class '" + self.__classname__ + "'>"
 
-    def __call__(self, *args, **kwargs):
-        """ Make new object from class """
-        from .current_prog import current_prog
+    def make_lookup(self, prog):
+        """ Makes the lookup tables of the objects (see `make_lookup`)
+
+        The tables are made when the class is closed, and made again
+        if classes are changed after that (a parent class may be declared again).
+        The Python type of the objects (see `make_object_type`) is made with the tables,
+        and it is only made again if the methods are changed, then objects of the class have the same type.
+        """
+        classes = [prog.classes[item] for item in self.__inheritance_tree__]
+        prop_levels, method_table = make_lookup(
+            [the_class.__props__ for the_class in classes],
+            [the_class.__methods__ for the_class in classes],
+        )
+        old_lookup = self.__lookup__
+        if old_lookup is not None and old_lookup[1].keys() == method_table.keys() \
+                and all(old_lookup[1][name] is method for name, method in method_table.items()):
+            object_type = old_lookup[3]
+        else:
+            object_type = make_object_type(self.__classname__, method_table)
+        self.__lookup__ = (prop_levels, method_table, prog.classes.version, object_type)
+        return self.__lookup__
+
+    def make_object(self, prog):
+        """ Makes new object from class without calling `__init__` """
+        lookup = self.__lookup__
+        if lookup is None or lookup[2] != prog.classes.version:
+            lookup = self.make_lookup(prog)
+        # methods are shared between the objects (they are bound to the object when they are accessed)
         the_props = []
         the_methods = []
+        memo = {}
         for item in self.__inheritance_tree__:
-            the_props.append(current_prog.classes[item].__props__)
-            the_methods.append(current_prog.classes[item].__methods__)
-        class_copy = ClassObject(copy.deepcopy(the_props), copy.deepcopy(the_methods))
+            the_props.append(copy_props(prog.classes[item].__props__, memo))
+            the_methods.append(prog.classes[item].__methods__)
+        class_copy = lookup[3](the_props, the_methods, lookup)
         class_copy.__theclass__ = self
-        class_copy.__name__
         class_copy.__inheritance_tree__ = self.__inheritance_tree__
-        tmp_is_in_class = False
-        try:
-            tmp_is_in_class = copy.deepcopy(current_prog.current_class)
-            current_prog.current_class = []
-        except:
-            pass
+        return class_copy
+
+    def __call__(self, *args, **kwargs):
+        """ Make new object from class """
+        from .current_prog import current_prog
+        class_copy = self.make_object(current_prog)
+        class_copy.__name__
+        tmp_is_in_class = current_prog.current_class
+        current_prog.current_class = []
         if len(args) == 1:
             args = args[0]
-        i = len(class_copy.__methods__)-1
-        init_method = None
-        while i >= 0:
-            try:
-                init_method = class_copy.__methods__[i]['__init__']
-                break
-            except KeyError:
-                pass
-            i -= 1
-        init_method(args)
-        if tmp_is_in_class:
-            current_prog.current_class = tmp_is_in_class
+        init_method = class_copy.__get_method__('__init__')
+        try:
+            init_method(args)
+        finally:
+            if tmp_is_in_class:
+                current_prog.current_class = tmp_is_in_class
         return class_copy
 
     def __getattr__(self, attrname):
-        if attrname in ['__props__', '__methods__', '__inheritance_tree__', '__classname__']:
+        if attrname in ['__props__', '__methods__', '__inheritance_tree__', '__classname__', '__lookup__']:
             return super().__getattr__(attrname)
         try:
             return self.__props__[attrname]
@@ -91,51 +147,60 @@ class Class:
                 raise AttributeError(attrname)
 
     def __setattr__(self, attrname, value):
-        if attrname in ['__props__', '__methods__', '__inheritance_tree__', '__classname__']:
+        if attrname in ['__props__', '__methods__', '__inheritance_tree__', '__classname__', '__lookup__']:
             return super().__setattr__(attrname, value)
         self.__props__[attrname] = value
 
 class ClassPropAndMethodCollection:
-    """ Only a object to handle properties and methods (Used by `super`) """
+    """ Only a object to handle properties and methods (Used by `super`)
+
+    The methods are bound to the object that is passed as third argument.
+    """
     def __init__(self, *args):
         try:
-            self.__methods__
             self.__props__
-            return self.__methods__['__init__'](args)
-        except:
-            pass
+            init = BoundMethod(self.__methods__['__init__'], self.__object__)
+        except (AttributeError, KeyError):
+            init = None
+        if init is not None:
+            # errors of the method (and `HandledError`) should not be caught here
+            return init(args)
         self.__methods__ = args[0]
         self.__props__ = args[1]
+        self.__object__ = args[2]
 
     def __getattr__(self, attrname):
-        if attrname in ['__props__', '__methods__']:
+        if attrname in ['__props__', '__methods__', '__object__']:
             return super().__getattr__(attrname)
         try:
             return self.__props__[attrname]
         except KeyError:
             try:
-                return self.__methods__[attrname]
+                return BoundMethod(self.__methods__[attrname], self.__object__)
             except KeyError:
                 raise AttributeError(attrname)
 
     def __setattr__(self, attrname, value):
-        if attrname in ['__props__', '__methods__']:
+        if attrname in ['__props__', '__methods__', '__object__']:
             return super().__setattr__(attrname, value)
         self.__props__[attrname] = value
 
     def __str__(self):
-        return self.__methods__['__str__']()
+        return BoundMethod(self.__methods__['__str__'], self.__object__)()
 
 class ClassObject:
-    """ Class initiated object """
-    def __init__(self, props: dict, methods: dict):
+    """ Class initiated object
+
+    `__props__` and `__methods__` are lists of the props and methods of the classes in the inheritance tree,
+    `__lookup__` is the lookup tables of the class (output of `make_lookup`).
+    Objects of the classes are made from subclasses of this (see `make_object_type`).
+    """
+    def __init__(self, props: list, methods: list, lookup=None):
         self.__props__ = props
         self.__methods__ = methods
-        i = 0
-        while i < len(self.__methods__):
-            for k in self.__methods__[i]:
-                self.__methods__[i][k].parent_object = self
-            i += 1
+        if lookup is None:
+            lookup = make_lookup(props, methods)
+        self.__lookup__ = lookup
         i = 0
         while i < len(self.__props__):
             for k in self.__props__[i]:
@@ -159,49 +224,40 @@ class ClassObject:
         if is_found == False:
             raise SuperError('unknow parent "' + name + '"')
             return
-        return ClassPropAndMethodCollection(self.__methods__[found_index], self.__props__[found_index])
+        return ClassPropAndMethodCollection(self.__methods__[found_index], self.__props__[found_index], self)
 
     def __get_method__(self, method_name: str):
-        """ Returns the method callable object """
-        method = None
-        i = len(self.__methods__)-1
-        while i >= 0:
-            try:
-                method = self.__methods__[i][method_name]
-                break
-            except KeyError:
-                pass
-            i -= 1
-        if method != None:
-            method.parent_object = self
-        return method
+        """ Returns the method callable object (a `BoundMethod`) """
+        method = self.__lookup__[1].get(method_name)
+        if method is None:
+            return None
+        return BoundMethod(method, self)
 
     def __getattr__(self, attrname):
-        from .current_prog import current_prog
-        if attrname in ['__props__', '__methods__', '__theclass__', '__inheritance_tree__']:
+        if attrname in ['__props__', '__methods__', '__theclass__', '__inheritance_tree__', '__lookup__']:
             return super().__getattr__(attrname)
-        try:
-            i = len(self.__props__)-1
-            while i >= 0:
-                try:
-                    if type(self.__props__[i][attrname]) == Function:
-                        self.__props__[i][attrname].parent_object = self
-                    return self.__props__[i][attrname]
-                except KeyError:
-                    pass
-                i -= 1
-            raise KeyError()
-        except KeyError:
-            try:
-                tmp_method = self.__get_method__(attrname)
-                if tmp_method != None:
-                    return tmp_method
-                raise KeyError()
-            except KeyError:
+        props = self.__props__
+        if attrname in props[-1]:
+            level = -1
+        else:
+            level = self.__lookup__[0].get(attrname)
+        if level is None or attrname not in props[level]:
+            method = self.__lookup__[1].get(attrname)
+            if method is not None:
+                return BoundMethod(method, self)
+            # the props that are added after making the lookup tables
+            level = len(props)-1
+            while level >= 0 and attrname not in props[level]:
+                level -= 1
+            if level < 0:
                 raise AttributeError(attrname)
+        value = props[level][attrname]
+        if type(value) == Function:
+            value.parent_object = self
+        return value
 
     def __setattr__(self, attrname, value):
-        if attrname in ['__props__', '__methods__', '__theclass__', '__inheritance_tree__']:
+        if attrname in ['__props__', '__methods__', '__theclass__', '__inheritance_tree__', '__lookup__']:
             return super().__setattr__(attrname, value)
         try:
             self.__props__[-1][attrname]
@@ -213,306 +269,34 @@ class ClassObject:
             pass
         self.__props__[-1][attrname] = value
 
-    # Magic methods start #
-
-    def __str__(self):
-        method = self.__get_method__('__str__')
-        if method is None:
-            return super().__str__()
-        return method()
-
-    def __eq__(self, other):
-        method = self.__get_method__('__eq__')
-        if method is None:
-            return super().__eq__(other)
-        return method(other)
-
-    def __ne__(self, other):
-        method = self.__get_method__('__ne__')
-        if method is None:
-            return super().__ne__(other)
-        return method(other)
-
-    def __lt__(self, other):
-        method = self.__get_method__('__lt__')
-        if method is None:
-            return super().__lt__(other)
-        return method(other)
-
-    def __gt__(self, other):
-        method = self.__get_method__('__gt__')
-        if method is None:
-            return super().__gt__(other)
-        return method(other)
-
-    def __le__(self, other):
-        method = self.__get_method__('__le__')
-        if method is None:
-            return super().__le__(other)
-        return method(other)
-
-    def __ge__(self, other):
-        method = self.__get_method__('__ge__')
-        if method is None:
-            return super().__ge__(other)
-        return method(other)
-
-    def __pos__(self):
-        method = self.__get_method__('__pos__')
-        if method is None:
-            return super().__pos__()
-        return method()
-
-    def __neg__(self):
-        method = self.__get_method__('__neg__')
-        if method is None:
-            return super().__neg__()
-        return method()
-
-    def __abs__(self):
-        method = self.__get_method__('__abs__')
-        if method is None:
-            return super().__abs__()
-        return method()
-
-    def __invert__(self):
-        method = self.__get_method__('__invert__')
-        if method is None:
-            return super().__invert__()
-        return method()
-
-    def __round__(self, n):
-        method = self.__get_method__('__round__')
-        if method is None:
-            return super().__round__(n)
-        return method(n)
-
-    def __floor__(self):
-        method = self.__get_method__('__floor__')
-        if method is None:
-            return super().__floor__()
-        return method()
-
-    def __ceil__(self):
-        method = self.__get_method__('__ceil__')
-        if method is None:
-            return super().__ceil__()
-        return method()
-
-    def __trunc__(self):
-        method = self.__get_method__('__trunc__')
-        if method is None:
-            return super().__trunc__()
-        return method()
-
-    def __add__(self, other):
-        method = self.__get_method__('__add__')
-        if method is None:
-            return super().__add__(other)
-        return method(other)
-
-    def __sub__(self, other):
-        method = self.__get_method__('__sub__')
-        if method is None:
-            return super().__sub__(other)
-        return method(other)
-
-    def __mul__(self, other):
-        method = self.__get_method__('__mul__')
-        if method is None:
-            return super().__mul__(other)
-        return method(other)
-
-    def __floordiv__(self, other):
-        method = self.__get_method__('__floordiv__')
-        if method is None:
-            return super().__floordiv__(other)
-        return method(other)
-
-    def __div__(self, other):
-        method = self.__get_method__('__div__')
-        if method is None:
-            return super().__div__(other)
-        return method(other)
-
-    def __truediv__(self, other):
-        method = self.__get_method__('__truediv__')
-        if method is None:
-            return super().__truediv__(other)
-        return method(other)
-
-    def __mod__(self, other):
-        method = self.__get_method__('__mod__')
-        if method is None:
-            return super().__mod__(other)
-        return method(other)
-
-    def __divmod__(self, other):
-        method = self.__get_method__('__divmod__')
-        if method is None:
-            return super().__divmod__(other)
-        return method(other)
-
-    def __pow__(self):
-        method = self.__get_method__('__pow__')
-        if method is None:
-            return super().__pow__()
-        return method()
-
-    def __lshift__(self, other):
-        method = self.__get_method__('__lshift__')
-        if method is None:
-            return super().__lshift__(other)
-        return method(other)
-        
-    def __rshift__(self, other):
-        method = self.__get_method__('__rshift__')
-        if method is None:
-            return super().__rshift__(other)
-        return method(other)
-        
-    def __and__(self, other):
-        method = self.__get_method__('__and__')
-        if method is None:
-            return super().__and__(other)
-        return method(other)
-        
-    def __or__(self, other):
-        method = self.__get_method__('__or__')
-        if method is None:
-            return super().__or__(other)
-        return method(other)
-        
-    def __xor__(self, other):
-        method = self.__get_method__('__xor__')
-        if method is None:
-            return super().__xor__(other)
-        return method(other)
-
-    def __radd__(self, other):
-        method = self.__get_method__('__radd__')
-        if method is None:
-            return super().__radd__(other)
-        return method(other)
-
-    def __rsub__(self, other):
-        method = self.__get_method__('__rsub__')
-        if method is None:
-            return super().__rsub__(other)
-        return method(other)
-
-    def __rmul__(self, other):
-        method = self.__get_method__('__rmul__')
-        if method is None:
-            return super().__rmul__(other)
-        return method(other)
-
-    def __rfloordiv__(self, other):
-        method = self.__get_method__('__rfloordiv__')
-        if method is None:
-            return super().__rfloordiv__(other)
-        return method(other)
-
-    def __rdiv__(self, other):
-        method = self.__get_method__('__rdiv__')
-        if method is None:
-            return super().__rdiv__(other)
-        return method(other)
-
-    def __rtruediv__(self, other):
-        method = self.__get_method__('__rtruediv__')
-        if method is None:
-            return super().__rtruediv__(other)
-        return method(other)
-
-    def __rmod__(self, other):
-        method = self.__get_method__('__rmod__')
-        if method is None:
-            return super().__rmod__(other)
-        return method(other)
-
-    def __rdivmod__(self, other):
-        method = self.__get_method__('__rdivmod__')
-        if method is None:
-            return super().__rdivmod__(other)
-        return method(other)
-
-    def __rpow__(self):
-        method = self.__get_method__('__rpow__')
-        if method is None:
-            return super().__rpow__()
-        return method()
-
-    def __rlshift__(self, other):
-        method = self.__get_method__('__rlshift__')
-        if method is None:
-            return super().__rlshift__(other)
-        return method(other)
-
-    def __rrshift__(self, other):
-        method = self.__get_method__('__rrshift__')
-        if method is None:
-            return super().__rrshift__(other)
-        return method(other)
-
-    def __rand__(self, other):
-        method = self.__get_method__('__rand__')
-        if method is None:
-            return super().__rand__(other)
-        return method(other)
-
-    def __ror__(self, other):
-        method = self.__get_method__('__ror__')
-        if method is None:
-            return super().__ror__(other)
-        return method(other)
-
-    def __rxor__(self, other):
-        method = self.__get_method__('__rxor__')
-        if method is None:
-            return super().__rxor__(other)
-        return method(other)
-
-    def __repr__(self):
-        method = self.__get_method__("__repr__")
-        if method is None:
-            return super().__repr__()
-        return method()
-    
-    def __unicode__(self):
-        method = self.__get_method__("__unicode__")
-        if method is None:
-            return super().__unicode__()
-        return method()
-    
-    def __format__(self, formatstr):
-        method = self.__get_method__("__format__")
-        if method is None:
-            return super().__format__(formatstr)
-        return method(formatstr)
-    
-    def __hash__(self):
-        method = self.__get_method__("__hash__")
-        if method is None:
-            return super().__hash__()
-        return method()
-    
-    def __nonzero__(self):
-        method = self.__get_method__("__nonzero__")
-        if method is None:
-            return super().__nonzero__()
-        return method()
-    
-    def __dir__(self):
-        method = self.__get_method__("__dir__")
-        if method is None:
-            return super().__dir__()
-        return method()
-    
-    def __sizeof__(self):
-        method = self.__get_method__("__sizeof__")
-        if method is None:
-            return super().__sizeof__()
-        return method()
-
-    # Magic methods end #
+MAGIC_METHODS = (
+    '__str__', '__eq__', '__ne__', '__lt__', '__gt__', '__le__', '__ge__',
+    '__pos__', '__neg__', '__abs__', '__invert__', '__round__', '__floor__', '__ceil__', '__trunc__',
+    '__add__', '__sub__', '__mul__', '__floordiv__', '__div__', '__truediv__', '__mod__', '__divmod__',
+    '__pow__', '__lshift__', '__rshift__', '__and__', '__or__', '__xor__',
+    '__radd__', '__rsub__', '__rmul__', '__rfloordiv__', '__rdiv__', '__rtruediv__', '__rmod__', '__rdivmod__',
+    '__rpow__', '__rlshift__', '__rrshift__', '__rand__', '__ror__', '__rxor__',
+    '__repr__', '__unicode__', '__format__', '__hash__', '__nonzero__', '__dir__', '__sizeof__',
+)
+""" Methods of a class that are used as magic methods of the Python type of its objects """
+
+def make_magic_method(method: Function):
+    """ Makes a Python magic method that runs the `method` on the object """
+    def magic_method(self, *args):
+        return method.call(args, {}, self)
+    return magic_method
+
+def make_object_type(name: str, method_table: dict) -> type:
+    """ Makes the Python type of the objects of a class
+
+    The type is a subclass of `ClassObject` that only has the magic methods that are declared in the class
+    (`method_table` is the output of `make_lookup`), then other operations have the default Python behavior.
+    """
+    namespace = {'__slots__': ()}
+    for method_name in MAGIC_METHODS:
+        if method_name in method_table:
+            namespace[method_name] = make_magic_method(method_table[method_name])
+    # Python removes the hash of the types that only have `__eq__`
+    if '__eq__' in namespace and '__hash__' not in namespace:
+        namespace['__hash__'] = ClassObject.__hash__
+    return type(name, (ClassObject,), namespace)
@@ -0,0 +1,133 @@
+#
+# frame.py
+#
+# The Pashmak Project
+# Copyright 2020-2021 parsa shahmaleki <parsampsh@gmail.com>
+#
+# This file is part of Pashmak.
+#
+# Pashmak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pashmak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Pashmak.  If not, see <https://www.gnu.org/licenses/>.
+#########################################################################
+
+""" Pashmak frame object """
+
+from collections.abc import MutableMapping
+
+UNSET = object() # value of the local variable slots that are not set
+
+class Frame:
+    """ A running code unit (the main code, a function call, a imported file...)
+
+    Variables of a isolated frame (function call) only keeps the local variables,
+    the globals are read from the first frame (see `Helpers.get_var`).
+    `names` caches the keys that a variable name is resolved to in this frame
+    and `resolve_key` is the frame part of the key of compiled evals
+    (they are cleared when namespaces are changed, see `Helpers.reset_var_keys`).
+    `invoke` is (<operation>, <function>, <memo-key>) for the frames of the calls that are run by `Program.run_invoke`
+    and `tail_calls` is count of the calls that reused this frame (see `Program.is_tail_frame`).
+    """
+    __slots__ = ('commands', 'current_step', 'vars', 'used_namespaces', 'imported_modules', 'names', 'resolve_key', 'eval_scope', 'invoke', 'tail_calls')
+
+    def __init__(self, commands: list, variables: dict, used_namespaces=None, imported_modules=None):
+        self.commands = commands
+        self.current_step = 0
+        self.vars = variables
+        self.used_namespaces = [] if used_namespaces is None else used_namespaces
+        self.imported_modules = [] if imported_modules is None else imported_modules
+        # cache of the resolved variable keys (see `Helpers.var_keys`)
+        self.names = {}
+        self.resolve_key = None
+        self.eval_scope = None # local scope of the evals (see `Program.make_eval_scope`)
+        self.invoke = None
+        self.tail_calls = 0
+
+    def rebind(self, commands: list, variables: dict):
+        """ Reuses the frame for running another code (tail call) """
+        self.commands = commands
+        self.current_step = 0
+        self.vars = variables
+        self.used_namespaces = []
+        self.imported_modules = []
+        self.names = {}
+        self.resolve_key = None
+        self.eval_scope = None
+
+    def __getitem__(self, key):
+        """ Frames were dicts, `frame['vars']` still works """
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+class Locals(MutableMapping):
+    """ Local variables of a function frame
+
+    Names in `slot_map` (the local variables of the function, see `Function.make_slots`)
+    are kept in the `slots` list, and the compiled evals read them by index.
+    Other names are kept in `extra` dict.
+    This object works like a dict, then `get()`, `set()`, `isset()` and python snippets still work.
+    """
+    __slots__ = ('slot_map', 'slots', 'extra')
+
+    def __init__(self, slot_map: dict):
+        self.slot_map = slot_map
+        self.slots = [UNSET] * len(slot_map)
+        self.extra = {}
+
+    def __getitem__(self, key):
+        index = self.slot_map.get(key)
+        if index is None:
+            return self.extra[key]
+        value = self.slots[index]
+        if value is UNSET:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        index = self.slot_map.get(key)
+        if index is None:
+            self.extra[key] = value
+        else:
+            self.slots[index] = value
+
+    def __delitem__(self, key):
+        index = self.slot_map.get(key)
+        if index is None:
+            del self.extra[key]
+        elif self.slots[index] is UNSET:
+            raise KeyError(key)
+        else:
+            self.slots[index] = UNSET
+
+    def __contains__(self, key):
+        index = self.slot_map.get(key)
+        if index is None:
+            return key in self.extra
+        return self.slots[index] is not UNSET
+
+    def __iter__(self):
+        for name in self.slot_map:
+            if self.slots[self.slot_map[name]] is not UNSET:
+                yield name
+        yield from self.extra
+
+    def __len__(self):
+        return len(self.slots) - self.slots.count(UNSET) + len(self.extra)
+
+    def __repr__(self):
+        return repr(dict(self))
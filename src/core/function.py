@@ -23,145 +23,429 @@
 """ Pashmak function system """
 
 import copy
-from . import parser
+import itertools
+import time
+from collections import OrderedDict
+from . import nodes, native, lexer, current_prog
+
+MISSING = object() # result of `MemoCache.get` when the call is not cached
 
 class Function:
     """ the pashmak function object """
     BUILTIN_WITHOUT_FRAME_ISOLATION_FUNCTIONS = ['import', 'import_once', 'import_run', 'import_run_once', 'mem', 'python', 'rmem', 'eval', 'debug']
     def __init__(self, name):
         self.name = name
+        self.namespace = name.rpartition('.')[0]
+        self.slot_map = None
+        self.native = native.NativeState()
         self.body = []
         self.args = []
         self.return_type = None
+        self.binder = ArgumentBinder([])
+        self.memo = None # cache of the returned values (`@memo`, see `MemoCache`)
+        self.uses_caller_frame = False # the function reads or changes frame of its caller by depth (`self.frames[-3]`), then it is not tail called
+
+    def __deepcopy__(self, memo):
+        """ Copies the function object, but the body, slots, arguments binder, native tier state and memo cache are shared between the copies """
+        result = self.__class__.__new__(self.__class__)
+        memo[id(self)] = result
+        for k in self.__dict__:
+            if k in ('body', 'slot_map', 'native', 'binder', 'memo'):
+                setattr(result, k, self.__dict__[k])
+            else:
+                setattr(result, k, copy.deepcopy(self.__dict__[k], memo))
+        return result
+
+    def make_slots(self):
+        """ Maps the local variables of the function to slot indexes
+
+        Local variables are the arguments and the assigned variables in the body
+        (bodies of the inner functions are skipped).
+        Frames of the function keep these variables in a list (`frame.Locals`),
+        and the compiled evals of the body read them by index instead of calling `get_var`.
+        """
+        if self.name in self.BUILTIN_WITHOUT_FRAME_ISOLATION_FUNCTIONS:
+            return
+        names = []
+        for arg in self.args:
+            arg_name = arg[0].split(' ', 1)[-1]
+            if arg_name != '':
+                names.append(arg_name[1:])
+        depth = 0
+        for op in self.body:
+            node = op['node']
+            if node.opcode == nodes.OP_FUNC:
+                depth += 1
+            elif node.opcode == nodes.OP_ENDFUNC:
+                depth -= 1
+            elif depth == 0 and isinstance(node, nodes.Assign) and node.kind == 'var':
+                names.append(node.name)
+        slot_map = {}
+        for name in names:
+            # consts are checked by `set_var`
+            if name not in slot_map and '&' not in name:
+                slot_map[name] = len(slot_map)
+        if slot_map:
+            self.slot_map = slot_map
+
+    def make_binder(self):
+        """ Parses the arguments and the return type once (see `ArgumentBinder`) """
+        self.binder = ArgumentBinder(self.args, self.return_type)
 
     def __validate_argument_type__(self, value, arg_type_full: str) -> bool:
         """ Gets a object and type defination string and validates object type """
-        from .current_prog import current_prog
-        # split the arg_type_full string by `|`
-        bracket_counter = 0
-        arg_parts = ['']
-        for ch in arg_type_full:
-            if ch == '|' and bracket_counter <= 0:
-                arg_parts.append('')
-            else:
-                arg_parts[-1] += ch
-                if ch == '[': bracket_counter += 1
-                elif ch == ']': bracket_counter -= 1
-        arg_parts = [item for item in arg_parts if item != '']
-        for arg_type in arg_parts:
-            item_parts = arg_type.split('[', 1)
-            arg_type = item_parts[0]
-            if len(item_parts) > 1:
-                if item_parts[1][-1] == ']':
-                    item_parts[1] = item_parts[1][:-1]
-            the_class = current_prog.get_class_real_name(arg_type)
-            if the_class != False:
-                if type(value).__name__ != 'ClassObject':
-                    return False
-                res = value.isinstanceof(the_class)
-                if res == True:
-                    return True
-                else:
-                    return None
-            arg_type_obj = current_prog.eval(arg_type)
-            result =  type(value) == arg_type_obj
-            if result:
-                if len(item_parts) > 1:
-                    # check the items in the list
-                    for item in value:
-                        if not self.__validate_argument_type__(item, item_parts[-1]):
-                            result = False
-                            break
-                if result: # if still result is True, return True
-                    return result
-        return False
+        return get_type_checker(arg_type_full)(value)
 
     def __call__(self, *args, **kwargs):
+        return self.call(args, kwargs, self.__dict__.get('parent_object'))
+
+    def call(self, args: tuple, kwargs: dict, this=None):
+        """ Runs the function
+
+        Args:
+            args(tuple): the positional arguments
+            kwargs(dict): the keyword arguments
+            this: the object that the method is called on (`$this`), or None
+        """
         from .current_prog import current_prog
-        if self.args:
-            tmp_args = list(args)
-            if len(tmp_args) == 1:
-                if type(tmp_args[0]) == tuple:
-                    tmp_args = list(tmp_args[0])
-        tmp_is_in_class = False
+        memo_key = None
+        if self.memo is not None:
+            memo_key = self.memo.key(args, kwargs, this)
+            if memo_key is not None:
+                value = self.memo.get(memo_key)
+                if value is not MISSING:
+                    return value
+        tmp_is_in_class = current_prog.current_class
+        current_prog.current_class = []
+        with_frame = this is not None or self.name not in self.BUILTIN_WITHOUT_FRAME_ISOLATION_FUNCTIONS
+        default_vars = self.bind_call(current_prog, args, kwargs, this)
+        if default_vars is None:
+            current_prog.current_class = tmp_is_in_class
+            return
+
+        # the body is shared between all of the calls (it is not changed while running)
+        # namespace of the function is used in the new frame
         try:
-            tmp_is_in_class = copy.deepcopy(current_prog.current_class)
-            current_prog.current_class = []
-        except:
-            pass
-        current_prog.mem = args
-        if len(current_prog.mem) == 1:
-            current_prog.mem = current_prog.mem[0]
+            current_prog.exec_func(self.body, with_frame, default_vars, self.namespace, self.slot_map, self)
+        finally:
+            if tmp_is_in_class:
+                current_prog.current_class = tmp_is_in_class
+        return self.return_value(current_prog, memo_key)
+
+    def bind_call(self, prog, args: tuple, kwargs: dict, this=None):
+        """ Puts the arguments of a call in mem and binds them to the variables of the function
+
+        Returns the variables that the frame of the call starts with,
+        or None if the arguments are not valid (the error is raised).
+        """
+        prog.mem = args
+        if len(args) == 1:
+            prog.mem = args[0]
         default_vars = {}
-        with_frame = True
-        try:
-            self.parent_object
-            default_vars['this'] = self.parent_object
-        except:
-            if self.name in self.BUILTIN_WITHOUT_FRAME_ISOLATION_FUNCTIONS:
-                with_frame = False
+        if this is not None:
+            default_vars['this'] = this
 
         # handle arguments
-        if self.args:
-            for arg in self.args:
-                arg_name = arg[0].split(' ', 1)
-                if len(arg_name) > 1:
-                    arg_type = arg_name[0]
-                    arg_name = arg_name[1]
-                else:
-                    arg_name = arg_name[0]
-                if arg_name != '':
-                    try:
-                        default_vars[arg_name[1:]] = kwargs[arg_name[1:]]
-                    except KeyError:
-                        if len(arg) > 1:
-                            default_vars[arg_name[1:]] = current_prog.eval(arg[1])
-
-            for arg in self.args:
-                arg_name = arg[0].split(' ', 1)
-                arg_type = None
-                if len(arg_name) > 1:
-                    arg_type = arg_name[0]
-                    arg_name = arg_name[1]
-                else:
-                    arg_name = arg_name[0]
-                if arg_name != '':
-                    if len(tmp_args) == 0:
-                        try:
-                            default_vars[arg_name[1:]]
-                        except:
-                            current_prog.raise_error('ArgumentError', 'too few arguments passed to function "' + self.name + '"')
-                            return
-                    else:
-                        default_vars[arg_name[1:]] = tmp_args[0]
-                        tmp_args.pop(0)
-                    if arg_type != None and default_vars[arg_name[1:]] != None:
-                        res = self.__validate_argument_type__(default_vars[arg_name[1:]], arg_type)
-                        if not res:
-                            if res is None:
-                                what_given = default_vars[arg_name[1:]].__theclass__.__name__
-                            else:
-                                what_given = str(type(default_vars[arg_name[1:]]))
-                            current_prog.raise_error('InvalidArgument', 'invalid argument type passed to "' + self.name + '" as "' + arg_name + '", it should be ' + arg_type + ', but ' + what_given + ' given')
-                            return
-
-        tmp_body = copy.deepcopy(self.body)
-        tmp_func_parts = self.name.split('.')
-        if len(tmp_func_parts) > 1:
-            func_namespace = ''
-            for part in tmp_func_parts[:-1]:
-                func_namespace += part + '.'
-            func_namespace = func_namespace.strip('.')
-            tmp_body.insert(0, parser.parse('use ' + func_namespace)[0])
-        current_prog.exec_func(tmp_body, with_frame, default_vars)
-        if tmp_is_in_class:
-            current_prog.current_class = tmp_is_in_class
-        result = current_prog.get_mem()
-        if self.return_type != None:
-            if not self.__validate_argument_type__(result, self.return_type):
+        binder = self.binder
+        if binder.args:
+            if len(args) == 1 and type(args[0]) == tuple:
+                args = args[0]
+            if not binder.bind(self, args, kwargs, default_vars):
+                return None
+        return default_vars
+
+    def return_value(self, prog, memo_key=None):
+        """ Returns the value that a finished call of the function returned (mem), after checking its type
+
+        The valid value is cached by `memo_key` if it is given (see `MemoCache.key`).
+        """
+        result = prog.get_mem()
+        binder = self.binder
+        if binder.return_checker is not None:
+            if not binder.return_checker(result):
                 # return value type is not valid. raise the error
                 what_given = str(type(result))
-                return current_prog.raise_error('InvalidReturnType',
-                    'invalid value returned by "' + self.name + '", it should be ' + self.return_type + ', but ' + what_given + ' returned'
+                return prog.raise_error('InvalidReturnType',
+                    'invalid value returned by "' + self.name + '", it should be ' + binder.return_type + ', but ' + what_given + ' returned'
                 )
+        if memo_key is not None:
+            self.memo.put(memo_key, result)
         return result
+
+class IdentityKey:
+    """ Part of a memo key that is compared by identity of the value (for the objects) """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __hash__(self):
+        return id(self.value)
+
+    def __eq__(self, other):
+        return type(other) is IdentityKey and other.value is self.value
+
+class MemoCache:
+    """ Cache of the returned values of a memoized function (`@memo`)
+
+    Results are kept by the arguments of the calls, the least recently used result is removed
+    when there are more than `size` results (None keeps all of them)
+    and a result is expired after `ttl` seconds (None keeps it until `clear` is called).
+    The time is read from `clock` (`time.monotonic` by default).
+    """
+    DEFAULT_SIZE = 128
+    __slots__ = ('size', 'ttl', 'results', 'hits', 'misses', 'clock')
+
+    def __init__(self, size=DEFAULT_SIZE, ttl=None, clock=time.monotonic):
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self.results = OrderedDict() # <key>:(<value>, <expire-time-or-None>)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, args: tuple, kwargs: dict, this=None):
+        """ Makes the key of a call from its arguments
+
+        Objects of the classes are compared by identity and other values by type and value.
+        Returns None if a argument is not hashable (the call is not cached).
+        """
+        from .class_system import ClassObject
+        parts = []
+        if this is not None:
+            parts.append(IdentityKey(this))
+        values = list(args)
+        for name in sorted(kwargs):
+            parts.append(name)
+            values.append(kwargs[name])
+        for value in values:
+            if isinstance(value, ClassObject):
+                parts.append(IdentityKey(value))
+            else:
+                parts.append((type(value), value))
+        key = tuple(parts)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, key):
+        """ Returns the cached result of a key, or `MISSING` """
+        try:
+            value, expire_time = self.results[key]
+        except KeyError:
+            self.misses += 1
+            return MISSING
+        if expire_time is not None and expire_time <= self.clock():
+            del self.results[key]
+            self.misses += 1
+            return MISSING
+        self.results.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """ Caches the result of a key """
+        expire_time = None
+        if self.ttl is not None:
+            expire_time = self.clock() + self.ttl
+        self.results[key] = (value, expire_time)
+        self.results.move_to_end(key)
+        if self.size is not None and len(self.results) > self.size:
+            self.results.popitem(last=False)
+
+    def clear(self):
+        """ Removes the cached results and resets the stats """
+        self.results.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        """ Returns hits, misses and size of the cache """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.results),
+            'maxsize': self.size,
+            'ttl': self.ttl,
+        }
+
+class BoundMethod:
+    """ A method of a object (`$obj->method`)
+
+    The methods are shared between the objects of a class,
+    the bound method keeps the object and runs the method with it as `$this`.
+    Other attributes are read from the method.
+    """
+    __slots__ = ('__func__', '__self__')
+
+    def __init__(self, func: Function, obj):
+        self.__func__ = func
+        self.__self__ = obj
+
+    def __call__(self, *args, **kwargs):
+        return self.__func__.call(args, kwargs, self.__self__)
+
+    @property
+    def parent_object(self):
+        return self.__self__
+
+    def __getattr__(self, attrname):
+        if attrname in ('__func__', '__self__', '__copy__', '__deepcopy__', '__getstate__', '__setstate__'):
+            raise AttributeError(attrname)
+        return getattr(self.__func__, attrname)
+
+class ArgumentBinder:
+    """ Arguments of a function, parsed once when the function is declared
+
+    Each argument is a tuple of (<name>, <name-with-$>, <type defination>, <type checker>, <default value expression>).
+    Defaults are `nodes.Expr` objects (then their code is compiled once)
+    and the type checkers are made by `get_type_checker`.
+    """
+    __slots__ = ('args', 'return_type', 'return_checker')
+
+    def __init__(self, args: list, return_type=None):
+        self.args = []
+        for arg in args:
+            arg_name = arg[0].split(' ', 1)
+            arg_type = None
+            if len(arg_name) > 1:
+                arg_type = arg_name[0]
+            arg_name = arg_name[-1]
+            if arg_name == '':
+                continue
+            checker = None
+            if arg_type != None:
+                checker = get_type_checker(arg_type)
+            default = None
+            if len(arg) > 1:
+                default = nodes.Expr(lexer.parse_eval(arg[1]))
+            self.args.append((arg_name[1:], arg_name, arg_type, checker, default))
+        self.return_type = return_type
+        self.return_checker = None
+        if return_type != None:
+            self.return_checker = get_type_checker(return_type)
+
+    def bind(self, func: Function, args: tuple, kwargs: dict, local_vars: dict) -> bool:
+        """ Puts the passed values of the arguments in `local_vars` (positional, keyword or default value)
+
+        Returns False if a error is raised.
+        """
+        from .current_prog import current_prog
+        args_count = len(args)
+        i = 0
+        for name, full_name, arg_type, checker, default in self.args:
+            if i < args_count:
+                value = args[i]
+            elif name in kwargs:
+                value = kwargs[name]
+            elif default is not None:
+                value = current_prog.eval(default)
+            else:
+                current_prog.raise_error('ArgumentError', 'too few arguments passed to function "' + func.name + '"')
+                return False
+            i += 1
+            local_vars[name] = value
+            if checker is not None and value != None:
+                res = checker(value)
+                if not res:
+                    if res is None:
+                        what_given = value.__theclass__.__name__
+                    else:
+                        what_given = str(type(value))
+                    current_prog.raise_error('InvalidArgument', 'invalid argument type passed to "' + func.name + '" as "' + full_name + '", it should be ' + arg_type + ', but ' + what_given + ' given')
+                    return False
+        return True
+
+type_checkers = {}
+""" The compiled type checkers, by their type defination string (see `get_type_checker`) """
+
+def get_type_checker(arg_type_full: str):
+    """ Returns the checker function of a type defination, like `int|list[str]|SomeClass`
+
+    Each type defination is compiled once and the checkers are shared by all of the functions.
+    The checker gets a value and returns True if the value is valid,
+    None if the value is a object but not instance of the class in the type defination, or False.
+    """
+    try:
+        return type_checkers[arg_type_full]
+    except KeyError:
+        checker = type_checkers[arg_type_full] = make_type_checker(parse_type(arg_type_full))
+        return checker
+
+def make_type_checker(arg_types: list):
+    """ Makes the checker function of a parsed type defination (output of `parse_type`)
+
+    Names of the types are resolved by `Program.resolve_type` (cached until the name resolution changes).
+    Only the first `Program.typed_items_limit` items of the typed lists are checked, if the limit is set.
+    """
+    from .class_system import ClassObject
+    parts = [(name, None if items is None else make_type_checker(items)) for name, items in arg_types]
+
+    def check(value) -> bool:
+        prog = current_prog.current_prog
+        for name, check_item in parts:
+            is_class, the_type = prog.resolve_type(name)
+            if is_class:
+                if not isinstance(value, ClassObject):
+                    return False
+                if is_instance(value, the_type) == True:
+                    return True
+                return None
+            if type(value) == the_type:
+                if check_item is None:
+                    return True
+                items = value
+                if prog.typed_items_limit is not None:
+                    items = itertools.islice(value, prog.typed_items_limit)
+                # check the items in the list
+                for item in items:
+                    if not check_item(item):
+                        break
+                else:
+                    return True
+        return False
+
+    return check
+
+def is_instance(value, class_name: str) -> bool:
+    """ Runs `$value->isinstanceof(<class_name>)`
+
+    If the method is not overridden (it is `Object.isinstanceof`), the check is done without calling the method.
+    """
+    method = value.__get_method__('isinstanceof')
+    try:
+        is_builtin = method.body is current_prog.current_prog.classes['Object'].__methods__['isinstanceof'].body
+    except (AttributeError, KeyError):
+        is_builtin = False
+    if not is_builtin:
+        return value.isinstanceof(class_name)
+    return class_name in value.__inheritance_tree__ or class_name in value.__traits__
+
+def parse_type(arg_type_full: str) -> list:
+    """ Parses a type defination string, like `int|list[str]|SomeClass`
+
+    Returns a list of the types, each item is (<type name>, <parsed type of the items or None>).
+    """
+    # split the arg_type_full string by `|`
+    bracket_counter = 0
+    arg_parts = ['']
+    for ch in arg_type_full:
+        if ch == '|' and bracket_counter <= 0:
+            arg_parts.append('')
+        else:
+            arg_parts[-1] += ch
+            if ch == '[': bracket_counter += 1
+            elif ch == ']': bracket_counter -= 1
+    arg_parts = [item for item in arg_parts if item != '']
+    result = []
+    for arg_type in arg_parts:
+        item_parts = arg_type.split('[', 1)
+        item_types = None
+        if len(item_parts) > 1:
+            if item_parts[1][-1:] == ']':
+                item_parts[1] = item_parts[1][:-1]
+            item_types = parse_type(item_parts[1])
+        result.append((item_parts[0], item_types))
+    return result
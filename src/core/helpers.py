@@ -61,21 +61,12 @@ class Helpers(builtin_functions.BuiltinFunctions):
 
     def variable_exists(self, varname: str) -> bool:
         """ Checks a variable is exists or not """
-        try:
-            self.all_vars()[self.current_namespace() + varname]
-            return True
-        except KeyError:
-            for used_namespace in self.frames[-1]['used_namespaces']:
-                try:
-                    self.all_vars()[used_namespace + '.' + varname]
+        keys = self.var_keys(varname)
+        for frame_vars in self.scope_chain():
+            for key in keys:
+                if key in frame_vars:
                     return True
-                except KeyError:
-                    pass
-            try:
-                self.all_vars()[varname]
-                return True
-            except KeyError:
-                return False
+        return False
 
     def variable_required(self, varname: str):
         """ Raises variable error if variable not exists """
@@ -88,46 +79,85 @@ class Helpers(builtin_functions.BuiltinFunctions):
 
     def get_var(self, varname: str, do_not_raise_error=False):
         """ Gets a variable name and returns value of that """
-        for frame in [self.frames[-1], self.frames[0]]:
-            try:
-                return frame['vars'][self.current_namespace() + varname]
-            except KeyError:
-                for used_namespace in self.frames[-1]['used_namespaces']:
-                    try:
-                        return frame['vars'][used_namespace + '.' + varname]
-                    except KeyError:
-                        pass
-                try:
-                    return frame['vars'][varname]
-                except KeyError:
-                    do_raise_error = False
-                    try:
-                        op = self.frames[-1]['commands'][self.frames[-1]['current_step']]
-                        do_raise_error = True
-                    except:
-                        pass
+        frame = self.frames[-1]
+        try:
+            keys = frame.names[varname]
+        except KeyError:
+            keys = self.var_keys(varname)
+        # local variables
+        frame_vars = frame.vars
+        for key in keys:
+            if key in frame_vars:
+                return frame_vars[key]
+        # global variables
+        global_vars = self.frames[0].vars
+        if global_vars is not frame_vars:
+            for key in keys:
+                if key in global_vars:
+                    return global_vars[key]
+        do_raise_error = False
+        try:
+            op = self.frames[-1].commands[self.frames[-1].current_step]
+            do_raise_error = True
+        except:
+            pass
         if do_raise_error and do_not_raise_error == False:
             raise VariableError('undefined variable "' + varname + '"')
             return
 
     def set_var(self, varname: str, value):
         """ Gets name of a variable and sets value on that """
+        # first key is the name in current namespace
+        key = self.var_keys(varname)[0]
         if '&' in varname:
             do_raise_error = False
             try:
-                if self.all_vars()[self.current_namespace() + varname] != None:
-                    op = self.frames[-1]['commands'][self.frames[-1]['current_step']]
+                if self.all_vars()[key] != None:
+                    op = self.frames[-1].commands[self.frames[-1].current_step]
                     do_raise_error = True
             except:
                 pass
             if do_raise_error:
                 self.raise_error('ConstError', '"' + varname + '" is a const and you cannot change that value', op)
                 return
-        self.all_vars()[self.current_namespace() + varname] = value
+        self.all_vars()[key] = value
+
+    def var_keys(self, varname: str) -> tuple:
+        """ Returns the keys that a variable name may be stored with, in order of priority
+
+        The keys are `<current-namespace>.<name>`, `<used-namespace>.<name>` and `<name>`.
+        They are cached on the current frame until namespaces are changed.
+        """
+        frame = self.frames[-1]
+        try:
+            return frame.names[varname]
+        except KeyError:
+            pass
+        keys = [self.current_namespace() + varname]
+        for used_namespace in frame.used_namespaces:
+            key = used_namespace + '.' + varname
+            if key not in keys:
+                keys.append(key)
+        if varname not in keys:
+            keys.append(varname)
+        keys = frame.names[varname] = tuple(keys)
+        return keys
+
+    def reset_var_keys(self):
+        """ Clears cached variable keys of the frames (should be called when namespaces are changed) """
+        for frame in self.frames:
+            frame.names.clear()
+            frame.resolve_key = None
 
     def all_vars(self):
         """ Returns list of all of variables """
-        return self.frames[-1]['vars']
+        return self.frames[-1].vars
+
+    def scope_chain(self):
+        """ Returns variables of the current frame (locals) and the first frame (globals) """
+        if len(self.frames) == 1:
+            return (self.frames[0].vars,)
+        return (self.frames[-1].vars, self.frames[0].vars)
 
     def print(self, obj, file=sys.stdout):
         """ Prints a object """
@@ -177,14 +207,42 @@ class Helpers(builtin_functions.BuiltinFunctions):
             while i > 0:
                 self.frames.pop()
                 i -= 1
-            self.frames[-1]['current_step'] = len(self.frames[-1]['commands']) * 2
+            self.frames[-1].current_step = len(self.frames[-1].commands) * 2
             self.exit_code = exit_code
 
     def pashmak_eval(self, code):
         """ Runs the pashmak code from string """
         # run the code
-        code_commands = parser.parse(code, filepath='<eval>')
-        self.exec_func(code_commands, False)
+        self.exec_func(self.parse_eval_code(code), False)
+
+    def parse_eval_code(self, code) -> list:
+        """ Parses the code of `eval()`
+
+        Parsed codes are cached by the source (least recently used code is removed when the cache is full),
+        the commands are not changed while running, then they are shared between the runs.
+        """
+        try:
+            commands = self.parse_cache[code]
+            self.parse_cache.move_to_end(code)
+            self.parse_cache_hits += 1
+            return commands
+        except KeyError:
+            pass
+        commands = parser.parse(code, filepath='<eval>')
+        self.parse_cache_misses += 1
+        if self.parse_cache_size > 0:
+            self.parse_cache[code] = commands
+            while len(self.parse_cache) > self.parse_cache_size:
+                self.parse_cache.popitem(last=False)
+        return commands
+
+    def parse_cache_info(self) -> dict:
+        """ Returns status of the cache of the parsed `eval()` codes """
+        return {
+            'hits': self.parse_cache_hits,
+            'misses': self.parse_cache_misses,
+            'size': len(self.parse_cache),
+        }
 
     def current_namespace(self):
         """ Returns current namespace """
@@ -195,4 +253,4 @@ class Helpers(builtin_functions.BuiltinFunctions):
 
     def signal_handler(self, signal_code, frame):
         """ Raise error when signal exception raised """
-        self.raise_error('Signal', str(signal_code), self.frames[-1]['commands'][self.frames[-1]['current_step']])
+        self.raise_error('Signal', str(signal_code), self.frames[-1].commands[self.frames[-1].current_step])
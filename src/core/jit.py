@@ -62,7 +62,16 @@ Also there is other arguments you can see them:
 import os
 import hashlib
 import pickle
-from . import parser
+from . import parser, optimizer
+
+CACHE_VERSION = 7
+""" Version of the parsed code structure, caches with other versions will be ignored """
+
+def replace_op(commands: list, index: int, op_str: str):
+    """ Replaces a operation in the parsed code with new one (keeps file path and line number) """
+    op = parser.parse(op_str, filepath=commands[index]['file_path'])[0]
+    op['line_number'] = commands[index]['line_number']
+    commands[index] = op
 
 def calc_file_sha256(filepath: str) -> str:
     """
@@ -116,7 +125,10 @@ def load(path: str, code_location: str, self=None, is_jit_disabled=False, ismain
             content += '\n$__file__ = ' + repr(self.get_var('__file__').replace('\\', '\\\\'))
             content += '\n$__dir__ = ' + repr(self.get_var('__dir__').replace('\\', '\\\\'))
             content += '\n$__ismain__ = ' + str(bool(self.get_var('__ismain__')))
-        return parser.parse(content, filepath=code_location)
+        content = parser.parse(content, filepath=code_location)
+        if optimizer.is_enabled():
+            content = optimizer.optimize(content)
+        return content
 
     try:
         file_hash = calc_file_sha256(path)
@@ -135,19 +147,14 @@ def load(path: str, code_location: str, self=None, is_jit_disabled=False, ismain
                 cache_f_content = pickle.load(cache_f)
                 cache_f.close()
                 the_hash = cache_f_content[0]
-                if the_hash == file_hash:
+                if the_hash == file_hash and cache_f_content[2:] == [CACHE_VERSION, optimizer.is_enabled()]:
                     content = cache_f_content[1]
                     if content:
                         if content[0]['str'].startswith('$__ismain__ = '):
-                            content[0]['str'] = '$__ismain__ = ' + str(ismain_default)
-                            content[0]['strings'] = parser.parse_string('$__ismain__ = ' + str(ismain_default))
-                            content[0]['args_str'] = '= ' + str(ismain_default)
-                            content[0]['args'] = ['=', str(ismain_default)]
+                            replace_op(content, 0, '$__ismain__ = ' + str(ismain_default))
                             if len(content) > 1 and self != None:
                                 if content[-1]['str'].startswith('$__ismain__ = '):
-                                    content[-1]['str'] = '$__ismain__ = ' + str(self.get_var('__ismain__'))
-                                    content[-1]['args_str'] = '= ' + str(self.get_var('__ismain__'))
-                                    content[-1]['args'] = ['=', str(self.get_var('__ismain__'))]
+                                    replace_op(content, -1, '$__ismain__ = ' + str(self.get_var('__ismain__')))
         except:
             pass
 
@@ -165,8 +172,11 @@ def load(path: str, code_location: str, self=None, is_jit_disabled=False, ismain
         # write the content on cache
         if is_new_cache:
             content = parser.parse(content, filepath=code_location)
+            if optimizer.is_enabled():
+                # the optimized code is cached, then optimizer runs once for each file
+                content = optimizer.optimize(content)
             cache_f = open(the_cache_file, 'wb')
-            pickle.dump([file_hash, content], cache_f)
+            pickle.dump([file_hash, content, CACHE_VERSION, optimizer.is_enabled()], cache_f)
             cache_f.close()
 
         return content
@@ -0,0 +1,524 @@
+#
+# native.py
+#
+# The Pashmak Project
+# Copyright 2020-2021 parsa shahmaleki <parsampsh@gmail.com>
+#
+# This file is part of Pashmak.
+#
+# Pashmak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pashmak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Pashmak.  If not, see <https://www.gnu.org/licenses/>.
+#########################################################################
+
+""" Pashmak native tier
+
+Hot functions are compiled to python functions.
+Body of the function is converted to python source (the `while` loops and the `if` blocks
+become python blocks and the evals are inlined), then the source is parsed by `ast`,
+line numbers of the tree are changed to the line numbers of the Pashmak code
+and the tree is compiled.
+
+The compiled function runs in the frame of the call, like the interpreter.
+`frame.current_step` is updated before each operation, then errors and tracebacks work as before.
+Functions that use a construct which is not supported here (labels, `try`, namespaces,
+nested functions, `import`, `eval`...) are run by the interpreter.
+"""
+
+import ast
+import re
+from . import nodes
+from .frame import Locals
+
+NOT_NATIVE_FUNCTIONS = ('import', 'import_once', 'import_run', 'import_run_once', 'python', 'eval', 'debug')
+""" Functions that change the frame they are called in, a function that calls them is not compiled """
+
+class NotSupported(Exception):
+    """ The function can not be compiled """
+    pass
+
+class NativeState:
+    """ Tiering state of a function (shared between the copies of the function)
+
+    `calls` is count of the calls since the last compile, `code` is the compiled function,
+    `key` is the name resolution key that `code` is compiled with,
+    and `error` is the reason if the function is not supported.
+    """
+    __slots__ = ('calls', 'code', 'key', 'error')
+
+    def __init__(self):
+        self.calls = 0
+        self.code = None
+        self.key = None
+        self.error = None
+
+class Compiler:
+    """ Converts body of a function to a python function """
+
+    def __init__(self, prog, func):
+        self.prog = prog
+        self.func = func
+        self.ops = func.body
+        self.start = 0 # range of the compiled operations
+        self.end = len(self.ops)
+        self.slot_map = func.slot_map
+        self.lines = [] # generated lines (<indent>, <code>, <index-of-the-op>)
+        self.indent = 1
+
+    def emit(self, code: str, index: int):
+        """ Adds a line to the generated code """
+        self.lines.append((self.indent, code, index))
+
+    def expr(self, expr) -> str:
+        """ Returns python code of a expression node """
+        for item in expr.tokens:
+            if item[0] == 'o' and self.prog.get_func_real_name(item[-1]) in NOT_NATIVE_FUNCTIONS:
+                raise NotSupported('function "' + item[-1] + '" is used')
+        return '(' + self.resolve(expr.tokens) + ')'
+
+    def resolve(self, tokens: list) -> str:
+        """ Converts the eval tokens to python code """
+        return self.prog.resolve_eval(tokens, self.slot_map)
+
+    def assign_var(self, name: str, value: str, i: int):
+        """ Generates assigning a value to a variable """
+        if self.slot_map and name in self.slot_map:
+            self.emit('__locals__[' + str(self.slot_map[name]) + '] = ' + value, i)
+        else:
+            self.emit('self.set_var(' + repr(name) + ', ' + value + ')', i)
+
+    def may_call(self, expr) -> bool:
+        """ Checks a expression may call a function (then the frames may be unwound by a error)
+
+        Operators may also call methods of the objects (like `__add__`),
+        then only a single variable or literal is known to not call anything.
+        """
+        if len(expr.tokens) != 1:
+            return True
+        item = expr.tokens[0]
+        if item[0] == 'o':
+            return not (item[-1][:1].isdigit() or item[-1] in ('True', 'False', 'None'))
+        return item[0] not in ('v', 's')
+
+    def check_frame(self, index: int, step=None):
+        """ Returns if the frame is not running anymore (a error is raised and handled by a outer frame)
+
+        `step` is the current step of the frame, if it is not `index`.
+        """
+        self.emit('if self.frames[-1] is not __frame__: return', index)
+
+    def system_op(self, index: int, command: str) -> dict:
+        """ Returns a operation that is generated by the parser for `if` blocks """
+        try:
+            op = self.ops[index]
+        except IndexError:
+            raise NotSupported('unexpected end of if block')
+        if op['file_path'] != '<system>' or op['command'] != command:
+            raise NotSupported('unexpected if block structure')
+        return op
+
+    def if_condition(self, index: int, visible_index: int):
+        """ Generates the branch (`mem not (<condition>)`) of a `if` or `elif` and opens the block """
+        node = self.ops[index]['node']
+        if node.opcode != nodes.OP_BRANCH:
+            raise NotSupported('unexpected if block structure')
+        self.emit('__frame__.current_step = ' + str(index), visible_index)
+        self.emit('self.mem = ' + self.expr(node.condition), visible_index)
+        if self.may_call(node.condition):
+            self.check_frame(visible_index, index)
+        self.emit('if not self.mem:', visible_index)
+        self.indent += 1
+        self.emit('pass', visible_index)
+
+    def compile_call(self, node, i: int):
+        """ Generates a function call operation """
+        real_name = self.prog.get_func_real_name(node.name)
+        if real_name == False:
+            self.emit('self.mem = ' + self.expr(node.expr), i)
+        elif real_name in NOT_NATIVE_FUNCTIONS:
+            raise NotSupported('function "' + real_name + '" is called')
+        elif node.name in ('mem', 'rmem'):
+            if self.prog.functions[real_name].body or not node.has_args:
+                self.emit('self.run_call(__ops__[' + str(i) + '])', i)
+            elif node.name == 'mem':
+                self.emit('self.mem = ' + self.expr(node.args), i)
+            else:
+                self.emit(self.expr(node.args), i)
+            if self.may_call(node.args):
+                self.check_frame(i)
+            return
+        else:
+            self.emit('self.mem = ' + self.expr(node.call), i)
+        self.check_frame(i)
+
+    def compile_assign(self, node, i: int):
+        """ Generates a assignment """
+        if node.value is None:
+            value = 'None'
+        else:
+            value = self.expr(node.value)
+        if node.kind == 'python':
+            self.emit('self.run_assign(__ops__[' + str(i) + '])', i)
+        elif node.kind == 'var':
+            self.assign_var(node.name, value, i)
+        else:
+            self.emit(self.resolve(node.target.tokens) + ' = ' + value, i)
+        if (node.value is not None and self.may_call(node.value)) or (node.target is not None and self.may_call(node.target)):
+            self.check_frame(i)
+
+    def compile_return(self, node, i: int):
+        """ Generates `return` """
+        if node.value is None:
+            self.emit('self.mem = None', i)
+        else:
+            self.emit('self.mem = ' + self.expr(node.value), i)
+        self.emit('return', i)
+
+    def compile_statement(self, op: dict, i: int):
+        """ Generates a operation that is not a block (assignment, call...) """
+        node = op['node']
+        opcode = node.opcode
+        if opcode in (nodes.OP_ASSIGN, nodes.OP_INCREMENT, nodes.OP_INVOKE_ASSIGN):
+            self.compile_assign(node, i)
+        elif opcode in (nodes.OP_CALL, nodes.OP_INVOKE_CALL):
+            self.compile_call(node, i)
+        elif opcode == nodes.OP_EXPR:
+            self.emit('self.mem = ' + self.expr(node.expr), i)
+            if self.may_call(node.expr):
+                self.check_frame(i)
+        elif opcode in (nodes.OP_RETURN, nodes.OP_INVOKE_RETURN):
+            self.compile_return(node, i)
+        else:
+            self.emit('self.run_atdoc(__ops__[' + str(i) + '])', i)
+
+    def fallback(self, op: dict, i: int, reason: str):
+        """ Called when a operation is not supported """
+        raise NotSupported(reason)
+
+    def prologue(self):
+        """ Generates start of the python function """
+        if self.slot_map:
+            self.emit('__locals__ = __frame__.vars.slots', 0)
+
+    def epilogue(self):
+        """ Generates end of the python function """
+        pass
+
+    def compile(self) -> str:
+        """ Returns python source of the function """
+        self.prologue()
+        blocks = [] # opened blocks, `['while']` or `['if', <count-of-elifs>]`
+        i = self.start
+        while i < self.end:
+            op = self.ops[i]
+            node = op.get('node')
+            if node is None:
+                raise NotSupported('operation is not parsed')
+            opcode = node.opcode
+            command = op['command']
+            if command == 'if':
+                self.emit('# ' + op['str'].strip(), i)
+                self.if_condition(i, i)
+                blocks.append(['if', 0])
+                i += 1
+                continue
+            if command in ('elif', 'else'):
+                if not blocks or blocks[-1][0] != 'if' or opcode != nodes.OP_GOTO:
+                    raise NotSupported('unexpected "' + command + '"')
+                self.system_op(i + 1, 'label')
+                self.indent -= 1
+                self.emit('else:', i)
+                self.indent += 1
+                self.emit('# ' + op['str'].strip(), i)
+                self.system_op(i + 2, 'mem')
+                self.if_condition(i + 2, i)
+                blocks[-1][1] += 1
+                i += 3
+                continue
+            if opcode == nodes.OP_PASS:
+                if command == 'endif':
+                    if not blocks or blocks[-1][0] != 'if':
+                        raise NotSupported('unexpected "endif"')
+                    self.system_op(i + 1, 'label')
+                    self.system_op(i + 2, 'label')
+                    self.indent -= 1 + blocks.pop()[1]
+                    i += 3
+                    continue
+                if command != 'pass':
+                    raise NotSupported('"' + command + '" is used')
+                i += 1
+                continue
+
+            self.emit('# ' + op['str'].strip(), i)
+            self.emit('__frame__.current_step = ' + str(i), i)
+            if opcode in (nodes.OP_ASSIGN, nodes.OP_INCREMENT, nodes.OP_CALL, nodes.OP_EXPR, nodes.OP_RETURN, nodes.OP_DOC) \
+                    or isinstance(node, nodes.Invoke):
+                lines_count = len(self.lines)
+                try:
+                    self.compile_statement(op, i)
+                except NotSupported as ex:
+                    del self.lines[lines_count:]
+                    self.fallback(op, i, str(ex))
+            elif opcode == nodes.OP_WHILE:
+                blocks.append(['while'])
+                self.emit('while True:', i)
+                self.indent += 1
+                self.emit('__frame__.current_step = ' + str(i), i)
+                self.emit('__value__ = ' + self.expr(node.condition), i)
+                if self.may_call(node.condition):
+                    self.check_frame(i)
+                self.emit('if not __value__: break', i)
+            elif opcode == nodes.OP_ENDWHILE:
+                if blocks and blocks[-1][0] == 'while':
+                    blocks.pop()
+                    self.indent -= 1
+                elif ['while'] in blocks:
+                    raise NotSupported('unexpected "endwhile"')
+            elif opcode in (nodes.OP_BREAK, nodes.OP_CONTINUE):
+                if ['while'] in blocks:
+                    self.emit(node.command, i)
+            else:
+                raise NotSupported('"' + op['command'] + '" is used')
+            i += 1
+        if blocks:
+            raise NotSupported('"' + blocks[-1][0] + '" block is not closed')
+        self.epilogue()
+
+        source = 'def ' + self.python_name() + '(self, __frame__, __ops__):\n'
+        source += '    pass\n'
+        for indent, code, index in self.lines:
+            source += '    ' * indent + code + '\n'
+        return source
+
+    def python_name(self) -> str:
+        """ Name of the generated python function """
+        return 'native_' + re.sub(r'\W', '_', self.func.name)
+
+    def build(self, scope: dict):
+        """ Compiles the function
+
+        Args:
+            scope(dict): globals of the compiled function
+        """
+        source = self.compile()
+        tree = ast.parse(source)
+        # python line numbers -> pashmak line numbers
+        line_numbers = [self.ops[0]['line_number'] if self.ops else 1]
+        for indent, code, index in self.lines:
+            line_number = self.ops[index]['line_number']
+            if type(line_number) is not int or line_number < 1:
+                line_number = line_numbers[-1]
+            line_numbers.append(line_number)
+        line_numbers.append(line_numbers[-1])
+        for item in ast.walk(tree):
+            if 'lineno' in item._attributes:
+                item.lineno = line_numbers[min(item.lineno, len(line_numbers)) - 1]
+                if getattr(item, 'end_lineno', None) is not None:
+                    item.end_lineno = item.lineno
+                    item.end_col_offset = max(item.col_offset, item.end_col_offset)
+        namespace = {}
+        exec(compile(tree, file_path(self.ops), 'exec'), scope, namespace)
+        return namespace[self.python_name()]
+
+class LoopCompiler(Compiler):
+    """ Converts a `while` loop of a frame that uses the global variables to a python function
+
+    Variables are read and written in the dict of the frame variables directly.
+    If a operation in the loop is not supported (like `return` or calling `import`),
+    the compiled loop gives control back to the interpreter at that operation,
+    and the compiled loop is entered again on the next `endwhile`.
+    When the loop is finished, the interpreter continues after the `endwhile`.
+    """
+
+    def __init__(self, prog, commands: list, start: int):
+        self.prog = prog
+        self.func = None
+        self.ops = commands
+        self.start = start
+        self.end = start + commands[start]['node'].end + 1
+        self.slot_map = None
+        self.lines = []
+        self.indent = 1
+
+    def resolve(self, tokens: list) -> str:
+        """ Converts the eval tokens to python code, variables are read from the frame """
+        resolved_tokens = []
+        for item in tokens:
+            if item[0] == 'v':
+                key = repr(item[1])
+                item = ['v', item[1], '(__vars__[' + key + '] if ' + key + ' in __vars__ else ' + item[-1] + ')']
+            resolved_tokens.append(item)
+        return self.prog.resolve_eval(resolved_tokens)
+
+    def assign_var(self, name: str, value: str, i: int):
+        """ Generates assigning a value to a variable """
+        if '&' in name:
+            # consts are checked by `set_var`
+            self.emit('self.set_var(' + repr(name) + ', ' + value + ')', i)
+        else:
+            self.emit('__vars__[' + repr(name) + '] = ' + value, i)
+
+    def check_frame(self, index: int, step=None):
+        """ Returns if the frame is not running anymore, or a error is handled by a `try` of the frame """
+        if step is None:
+            step = index
+        self.emit('if self.frames[-1] is not __frame__ or __frame__.current_step != ' + str(step) + ': return', index)
+
+    def compile_return(self, node, i: int):
+        """ `return` in the main code exits the program, that is done by the interpreter """
+        raise NotSupported('"return" is used')
+
+    def fallback(self, op: dict, i: int, reason: str):
+        """ Gives control back to the interpreter at the operation """
+        self.emit('__frame__.current_step = ' + str(i - 1), i)
+        self.emit('return', i)
+
+    def prologue(self):
+        """ Generates start of the python function """
+        self.emit('__vars__ = __frame__.vars', self.start)
+
+    def epilogue(self):
+        """ Loop is finished, interpreter continues after the `endwhile` """
+        self.emit('__frame__.current_step = ' + str(self.end - 1), self.end - 1)
+
+    def python_name(self) -> str:
+        """ Name of the generated python function """
+        return 'loop_' + str(self.start)
+
+def file_path(body: list) -> str:
+    """ Returns the file that a function body is declared in """
+    for op in body:
+        if op['file_path'] != '<system>':
+            return op['file_path']
+    return '<system>'
+
+def get_native(prog, func):
+    """ Returns the compiled function if the function is hot (None means the interpreter should run it)
+
+    The function is compiled after `prog.NATIVE_CALLS_THRESHOLD` calls,
+    and compiled again when name resolution (functions, classes and defines) changes.
+    Frame of the call should be the last frame.
+    """
+    state = func.native
+    if state.error is not None or prog.NATIVE_CALLS_THRESHOLD is None:
+        return None
+    if len(prog.frames) > prog.NATIVE_DEPTH_LIMIT:
+        # deep calls are run by the interpreter, then they do not nest python calls
+        return None
+    key = (prog.functions.version, prog.classes.version, prog.defines.version)
+    if state.key == key:
+        return state.code
+    state.calls += 1
+    if state.calls < prog.NATIVE_CALLS_THRESHOLD:
+        return None
+    state.calls = 0
+    try:
+        state.code = Compiler(prog, func).build(prog.native_scope)
+    except NotSupported as ex:
+        state.error = str(ex)
+        return None
+    state.key = key
+    return state.code
+
+def get_native_loop(prog, op: dict, frame):
+    """ Returns the compiled loop if the loop is hot (None means the interpreter should run it)
+
+    This is called on the `endwhile` operations (`op`) of the frames that use the global variables,
+    after jumping back to the `while`.
+    The loop is compiled after `prog.NATIVE_LOOP_THRESHOLD` jumps back,
+    and compiled again when name resolution (functions, classes, defines and used namespaces) changes.
+    The state is kept in the `nodes.EndWhile` of the loop, then it is freed with the operations.
+    """
+    if prog.NATIVE_LOOP_THRESHOLD is None:
+        return None
+    node = op['node']
+    state = node.native
+    if state is None:
+        # the state is made when the loop is hot, then the cold loops do not keep it
+        node.jumps += 1
+        if node.jumps < prog.NATIVE_LOOP_THRESHOLD:
+            return None
+        state = node.native = NativeState()
+        # the loop is compiled now
+        state.calls = prog.NATIVE_LOOP_THRESHOLD - 1
+    if state.error is not None:
+        return None
+    key = (
+        prog.functions.version,
+        prog.classes.version,
+        prog.defines.version,
+        tuple(frame.used_namespaces),
+        id(frame.commands),
+    )
+    if state.key == key:
+        return state.code
+    state.calls += 1
+    if state.calls < prog.NATIVE_LOOP_THRESHOLD:
+        return None
+    state.calls = 0
+    start = frame.current_step + 1
+    try:
+        if frame.commands[start]['node'].opcode != nodes.OP_WHILE:
+            raise NotSupported('loop is not started by "while"')
+        state.code = LoopCompiler(prog, frame.commands, start).build(prog.native_scope)
+    except NotSupported as ex:
+        state.error = str(ex)
+        return None
+    state.key = key
+    return state.code
+
+def emit(prog, commands: list) -> str:
+    """ Returns the generated python code of the functions declared in the commands
+
+    Declarations (functions, classes and namespaces) of the commands are run,
+    but the code is not run.
+    """
+    from .frame import Frame
+    declaration_commands = ('func', 'endfunc', 'class', 'endclass', 'namespace', 'ns', 'endnamespace', 'endns', 'use')
+    depth = 0
+    for op in commands:
+        if depth == 0 and op['command'] not in declaration_commands:
+            continue
+        if op['command'] in ('func', 'class'):
+            depth += 1
+        elif op['command'] in ('endfunc', 'endclass'):
+            depth -= 1
+        prog.run(op)
+
+    # functions and methods that are declared in the commands
+    file_paths = [op['file_path'] for op in commands if op['file_path'] != '<system>']
+    names = []
+    for name in prog.functions:
+        # python functions (like `print`) are also in the functions
+        if file_path(getattr(prog.functions[name], 'body', [])) in file_paths:
+            names.append(name)
+    for class_name in prog.classes:
+        for method_name in prog.classes[class_name].__methods__:
+            if file_path(prog.classes[class_name].__methods__[method_name].body) in file_paths:
+                names.append(class_name + '->' + method_name)
+
+    output = ''
+    for name in names:
+        parts = name.split('->', 1)
+        if len(parts) > 1:
+            func = prog.classes[parts[0]].__methods__[parts[1]]
+        else:
+            func = prog.functions[name]
+        variables = Locals(func.slot_map) if func.slot_map else {}
+        used_namespaces = [func.namespace] if func.namespace else []
+        prog.frames.append(Frame(func.body, variables, used_namespaces))
+        try:
+            output += '# ' + name + '\n' + Compiler(prog, func).compile() + '\n'
+        except NotSupported as ex:
+            output += '# ' + name + ': not compiled, ' + str(ex) + '\n\n'
+        prog.frames.pop()
+    return output
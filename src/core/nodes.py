@@ -0,0 +1,286 @@
+#
+# nodes.py
+#
+# The Pashmak Project
+# Copyright 2020-2021 parsa shahmaleki <parsampsh@gmail.com>
+#
+# This file is part of Pashmak.
+#
+# Pashmak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pashmak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Pashmak.  If not, see <https://www.gnu.org/licenses/>.
+#########################################################################
+
+""" Pashmak syntax tree nodes
+
+The parser classifies each operation once and puts a node in `op['node']`.
+Then, the executor runs the node and does not split and check
+strings of the operation every time that operation runs.
+
+The nodes are cached by Jit and also are mixed in `src/core/modules.py`,
+so `repr()` of each node is a valid python code to make that node again.
+"""
+
+__all__ = [
+    'Expr', 'Target', 'Node', 'Statement', 'Assign', 'Call', 'ExprStatement',
+    'While', 'EndWhile', 'Break', 'Continue', 'Return', 'Goto', 'GotoIf', 'Try',
+    'Increment', 'Branch', 'Invoke', 'InvokeCall', 'InvokeAssign', 'InvokeReturn',
+]
+
+# the opcodes
+# executor has a table of handlers for the opcodes (`Program.dispatch`)
+OP_FUNC = 0
+OP_ENDFUNC = 1
+OP_PASS = 2
+OP_CLASS = 3
+OP_ENDCLASS = 4
+OP_ASSIGN = 5
+OP_CALL = 6
+OP_EXPR = 7
+OP_WHILE = 8
+OP_ENDWHILE = 9
+OP_BREAK = 10
+OP_CONTINUE = 11
+OP_GOTO = 12
+OP_GOTOIF = 13
+OP_TRY = 14
+OP_ENDTRY = 15
+OP_RETURN = 16
+OP_NAMESPACE = 17
+OP_ENDNAMESPACE = 18
+OP_USE = 19
+OP_DOC = 20
+OP_INCREMENT = 21
+OP_BRANCH = 22
+OP_INVOKE_CALL = 23
+OP_INVOKE_ASSIGN = 24
+OP_INVOKE_RETURN = 25
+OP_MEMO = 26
+
+OPCODES_COUNT = 27
+
+COMMAND_OPCODES = {
+    'pass': OP_PASS,
+    'label': OP_PASS,
+    'if': OP_PASS,
+    'elif': OP_PASS,
+    'else': OP_PASS,
+    'endif': OP_PASS,
+    'end': OP_PASS,
+    'func': OP_FUNC,
+    'endfunc': OP_ENDFUNC,
+    'class': OP_CLASS,
+    'endclass': OP_ENDCLASS,
+    'while': OP_WHILE,
+    'endwhile': OP_ENDWHILE,
+    'break': OP_BREAK,
+    'continue': OP_CONTINUE,
+    'goto': OP_GOTO,
+    'gotoif': OP_GOTOIF,
+    'try': OP_TRY,
+    'endtry': OP_ENDTRY,
+    'return': OP_RETURN,
+    'namespace': OP_NAMESPACE,
+    'ns': OP_NAMESPACE,
+    'endnamespace': OP_ENDNAMESPACE,
+    'endns': OP_ENDNAMESPACE,
+    'use': OP_USE,
+    '@doc': OP_DOC,
+    '@memo': OP_MEMO,
+}
+""" Opcodes of the builtin commands """
+
+class Expr:
+    """ A eval expression
+
+    Keeps the tokens (output of `lexer.parse_eval`) and the compiled code
+    of the expression (compiled code is not pickled or copied).
+    """
+    __slots__ = ('tokens', 'code', 'resolve_key')
+    mode = 'eval'
+    template = '{}'
+
+    def __init__(self, tokens: list):
+        self.tokens = tokens
+        self.code = None
+        self.resolve_key = None
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(' + repr(self.tokens) + ')'
+
+    def __getstate__(self):
+        return self.tokens
+
+    def __setstate__(self, state):
+        self.__init__(state)
+
+class Target(Expr):
+    """ Target of a assignment, for example `$obj->name` or `$list[0]` """
+    __slots__ = ()
+    mode = 'exec'
+    template = '{} = value'
+
+class Node:
+    """ Base of the nodes """
+    __slots__ = fields = ()
+
+    def __init__(self, *args):
+        for name, value in zip(self.fields, args):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(' + ', '.join([repr(getattr(self, name)) for name in self.fields]) + ')'
+
+    def __getstate__(self):
+        return [getattr(self, name) for name in self.fields]
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+class Statement(Node):
+    """ A builtin command which is handled by `run_<command>` methods, like `func`, `class` and `endtry` """
+    __slots__ = fields = ('opcode', 'command')
+
+class Assign(Node):
+    """ `$<name> = <value>` and other assignments
+
+    kind is one of the following:
+        `var`: `$name = <value>` (also declaring `$name` without value)
+        `attr`: `$obj->name = <value>`
+        `item`: `$list[0] = <value>`
+        `python`: `<python-name> = <value>`
+    """
+    opcode = OP_ASSIGN
+    __slots__ = fields = ('kind', 'name', 'target', 'value')
+
+class Increment(Assign):
+    """ `$<name> = $<name> + <number>` (or `-`), made by `parser.fuse_ops`
+
+    `step` is the number that is added to the variable (negative for `-`).
+    The other fields are same as `Assign`.
+    """
+    opcode = OP_INCREMENT
+    __slots__ = ('step',)
+    fields = ('kind', 'name', 'target', 'value', 'step')
+
+class Call(Node):
+    """ Calling a function as command, like `println 'hello'` or `println('hello')`
+
+    If the name is not a function while running, whole of
+    operation will be evaluated as a expression (`expr`).
+    """
+    opcode = OP_CALL
+    __slots__ = fields = ('name', 'args', 'has_args', 'call', 'expr')
+
+class ExprStatement(Node):
+    """ A expression as a operation, like `$obj->method()` """
+    opcode = OP_EXPR
+    __slots__ = fields = ('expr',)
+
+class While(Node):
+    """ `while <condition>`
+
+    `end` is distance to the matching `endwhile` (calculated by `parser.make_jumps`).
+    """
+    opcode = OP_WHILE
+    __slots__ = fields = ('command', 'condition', 'end')
+
+class EndWhile(Node):
+    """ `endwhile`, `start` is distance to the matching `while` (negative)
+
+    `jumps` and `native` are the tiering state of the loop (see `native.get_native_loop`),
+    they are not pickled or copied.
+    """
+    opcode = OP_ENDWHILE
+    __slots__ = ('command', 'start', 'jumps', 'native')
+    fields = ('command', 'start')
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.jumps = 0
+        self.native = None
+
+class Break(Node):
+    """ `break`, `end` is distance to `endwhile` of the loop """
+    opcode = OP_BREAK
+    __slots__ = fields = ('command', 'end')
+
+class Continue(Node):
+    """ `continue`, `start` is distance to `while` of the loop (negative) """
+    opcode = OP_CONTINUE
+    __slots__ = fields = ('command', 'start')
+
+class Return(Node):
+    """ `return <value>` """
+    opcode = OP_RETURN
+    __slots__ = fields = ('command', 'value')
+
+class Goto(Node):
+    """ `goto <label>`, `offset` is distance to the label (None if label is not declared) """
+    opcode = OP_GOTO
+    __slots__ = fields = ('command', 'label', 'offset')
+
+class GotoIf(Goto):
+    """ `gotoif <label>` """
+    opcode = OP_GOTOIF
+    __slots__ = ()
+
+class Try(Goto):
+    """ `try <label>` """
+    opcode = OP_TRY
+    __slots__ = ()
+
+class Branch(Goto):
+    """ `mem not (<condition>)` and `gotoif <label>` of the `if` blocks in one node, made by `parser.fuse_ops`
+
+    `condition` is the `not (<condition>)` expression.
+    Its value is put in mem and jumps to the label if it is True.
+    """
+    opcode = OP_BRANCH
+    __slots__ = ('condition',)
+    fields = ('command', 'label', 'offset', 'condition')
+
+class Invoke:
+    """ Base of the nodes that call a function by its name, like `f($a, $b)`, made by `parser.make_invokes`
+
+    `function` is name of the function and `arguments` is the `__call_args__(<arguments>)` expression
+    which returns the arguments as (<args>, <kwargs>).
+    If the name is a Pashmak function while running, frame of the call is run by the loop of the interpreter
+    (see `Program.run_invoke`), otherwise the node is run like its base node (`base_opcode`).
+    `resolved` caches the function that the name is resolved to.
+    """
+    __slots__ = ()
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.resolved = None
+
+class InvokeCall(Invoke, Call):
+    """ `f(<arguments>)` as command """
+    opcode = OP_INVOKE_CALL
+    base_opcode = OP_CALL
+    __slots__ = ('function', 'arguments', 'resolved')
+    fields = Call.fields + ('function', 'arguments')
+
+class InvokeAssign(Invoke, Assign):
+    """ `$<name> = f(<arguments>)` """
+    opcode = OP_INVOKE_ASSIGN
+    base_opcode = OP_ASSIGN
+    __slots__ = ('function', 'arguments', 'resolved')
+    fields = Assign.fields + ('function', 'arguments')
+
+class InvokeReturn(Invoke, Return):
+    """ `return f(<arguments>)` """
+    opcode = OP_INVOKE_RETURN
+    base_opcode = OP_RETURN
+    __slots__ = ('function', 'arguments', 'resolved')
+    fields = Return.fields + ('function', 'arguments')
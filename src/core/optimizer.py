@@ -0,0 +1,380 @@
+#
+# optimizer.py
+#
+# The Pashmak Project
+# Copyright 2020-2021 parsa shahmaleki <parsampsh@gmail.com>
+#
+# This file is part of Pashmak.
+#
+# Pashmak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pashmak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Pashmak.  If not, see <https://www.gnu.org/licenses/>.
+#########################################################################
+
+""" Pashmak optimizer
+
+Optimizes the parsed code before it is cached by Jit (only if `PASHMAK_OPTIMIZE` environment variable is set).
+
+The passes:
+    - inlining the defines that are declared by `define()` with literal values in the same file
+    - folding constant expressions, like `60 * 60` or `(2 + 3)`
+    - removing the `if`, `elif` and `else` branches that their condition is a literal and never run
+    - removing the unreachable operations after `return`
+    - hoisting `len($var)` out of `while` conditions if the loop does not use `$var`
+
+The optimizer assumes that `true`, `false` and `null` are not declared as functions or classes,
+and the defines that are declared in a file are not changed by the other files.
+"""
+
+import os
+import ast
+import math
+import warnings
+from . import nodes, parser
+
+LITERAL_NAMES = {'true': True, 'false': False, 'null': None, 'True': True, 'False': False, 'None': None}
+""" Names that are known as literals """
+
+KEYWORD_OPERATORS = ('not', 'and', 'or', 'is', 'in', 'if', 'else')
+
+OPERATOR_CHARS = '+-*/%<>=!()&|~ '
+""" Characters that a folded expression may have out of the literals """
+
+PURE_FUNCTIONS = ('len', 'str', 'int', 'float', 'bool', 'abs', 'min', 'max', 'round', 'repr', 'print', 'println')
+""" Functions that do not change their arguments (calling them in a loop does not prevent hoisting) """
+
+def is_enabled() -> bool:
+    """ Checks the optimizer is enabled (by `PASHMAK_OPTIMIZE` environment variable) """
+    try:
+        return bool(os.environ['PASHMAK_OPTIMIZE'])
+    except KeyError:
+        return False
+
+def optimize(commands: list) -> list:
+    """ Runs the optimizer passes on the parsed code and returns the optimized code
+
+    Args:
+        commands(list): output of `parser.parse`
+    """
+    inline_defines(commands)
+    for op in commands:
+        for expr in node_exprs(op['node']):
+            expr.tokens = fold(expr.tokens)
+    commands = remove_dead_branches(commands)
+    commands = remove_unreachable(commands)
+    parser.make_jumps(commands)
+    commands = hoist_invariants(commands)
+    parser.make_jumps(commands)
+    return commands
+
+def node_exprs(node) -> list:
+    """ Returns the expressions of a node that are evaluated as values (not assignment targets) """
+    exprs = []
+    if isinstance(node, nodes.Call):
+        exprs = [node.args, node.call, node.expr]
+    elif isinstance(node, nodes.ExprStatement):
+        exprs = [node.expr]
+    elif isinstance(node, (nodes.While, nodes.Branch)):
+        exprs = [node.condition]
+    elif isinstance(node, (nodes.Assign, nodes.Return)) and node.value is not None:
+        exprs = [node.value]
+    if isinstance(node, nodes.Invoke):
+        exprs.append(node.arguments)
+    return exprs
+
+def is_number(word: str) -> bool:
+    """ Checks a word is a number literal """
+    return word[:1].isdigit() and all(ch.isalnum() or ch in '._' for ch in word)
+
+def literal_value(tokens: list):
+    """ Evaluates a expression that only has literals and operators
+
+    Returns:
+        tuple: (<is-literal>, <value>)
+    """
+    if not tokens:
+        return False, None
+    code = ''
+    has_string = False
+    for item in tokens:
+        if item[0] == 's':
+            has_string = True
+            code += item[-1]
+        elif item[0] == 'o' and (is_number(item[-1]) or item[-1] in LITERAL_NAMES or item[-1] in KEYWORD_OPERATORS):
+            code += item[-1] + ' '
+        elif item[0] == 'l' and all(ch in OPERATOR_CHARS for ch in item[-1]):
+            code += item[-1]
+        else:
+            return False, None
+    # big powers and repeated strings are not made while parsing
+    if '**' in code or '<<' in code or (has_string and '*' in code):
+        return False, None
+    try:
+        with warnings.catch_warnings():
+            # compiling some literals warns (like `1 is 1`), the warnings should not be printed while optimizing
+            warnings.simplefilter('ignore')
+            value = eval(code, {'__builtins__': {}}, dict(LITERAL_NAMES))
+    except Exception:
+        # errors are raised while running
+        return False, None
+    if type(value) not in (bool, int, float, str, type(None)):
+        return False, None
+    if type(value) is float and not math.isfinite(value):
+        return False, None
+    if len(repr(value)) > 100:
+        return False, None
+    return True, value
+
+def literal_token(value) -> list:
+    """ Returns the eval token of a literal value """
+    if type(value) is str:
+        return ['s', repr(value)]
+    return ['o', repr(value)]
+
+def fold(tokens: list) -> list:
+    """ Folds the constant parts of a expression (whole of the expression or the parentheses) """
+    is_literal, value = literal_value(tokens)
+    if is_literal:
+        return [literal_token(value)]
+    result = []
+    open_parentheses = []
+    for item in tokens:
+        result.append(item)
+        if item == ['l', '(']:
+            open_parentheses.append(len(result) - 1)
+        elif item == ['l', ')'] and open_parentheses:
+            start = open_parentheses.pop()
+            is_literal, value = literal_value(result[start+1:-1])
+            if is_literal:
+                result[start+1:-1] = [literal_token(value)]
+    if result == tokens:
+        return tokens
+    return result
+
+def strip_parentheses(tokens: list) -> list:
+    """ `(a, b)` -> `a, b` """
+    if len(tokens) >= 2 and tokens[0] == ['l', '('] and tokens[-1] == ['l', ')']:
+        return tokens[1:-1]
+    return tokens
+
+def string_value(item: list):
+    """ Returns value of a string token """
+    try:
+        return ast.literal_eval(item[-1])
+    except Exception:
+        return None
+
+def inline_defines(commands: list):
+    """ Puts value of the defines in the expressions that use them
+
+    Only `define('NAME', <literal>)` calls in top level of the file (not in any block) are inlined,
+    and the uses after the define are changed.
+    If the file uses `goto`, or mentions the name in a string (like `undefine('NAME')`), the define is not inlined.
+    """
+    for op in commands:
+        if op['command'] in ('goto', 'gotoif') and op['file_path'] != '<system>':
+            return
+    depth = 0
+    defines = [] # (<index>, <name>, <value>)
+    for i in range(len(commands)):
+        op = commands[i]
+        node = op['node']
+        if op['command'] in ('if', 'while', 'try', 'namespace', 'ns', 'class', 'func'):
+            depth += 1
+        elif op['command'] in ('endif', 'endwhile', 'endtry', 'endnamespace', 'endns', 'endclass', 'endfunc'):
+            depth -= 1
+        elif depth == 0 and isinstance(node, nodes.Call) and node.name == 'define' and node.has_args:
+            args = strip_parentheses(node.args.tokens)
+            if len(args) < 3 or args[0][0] != 's' or args[1] != ['l', ',']:
+                continue
+            name = string_value(args[0])
+            is_literal, value = literal_value(args[2:])
+            if type(name) is str and name.isidentifier() and is_literal:
+                defines.append((i, name, value))
+
+    for index, name, value in defines:
+        # check the name is not used in other ways
+        is_safe = True
+        for i in range(len(commands)):
+            op = commands[i]
+            if op['command'] in ('func', 'class') and op['args'] and op['args'][0].split('(')[0].split('::')[-1].split('<')[0].strip() == name:
+                is_safe = False
+            if i != index:
+                for item in op['eval']:
+                    if item[0] == 's' and name in item[-1]:
+                        is_safe = False
+        if not is_safe:
+            continue
+        for op in commands[index+1:]:
+            for expr in node_exprs(op['node']):
+                if ['o', name] in expr.tokens:
+                    expr.tokens = [literal_token(value) if item == ['o', name] else item for item in expr.tokens]
+
+def branch_value(commands: list, index: int):
+    """ Returns literal value of the branch (`mem not (<condition>)`) at the index (or None if that is not a literal) """
+    try:
+        node = commands[index]['node']
+    except IndexError:
+        return None
+    if not isinstance(node, nodes.Branch):
+        return None
+    is_literal, value = literal_value(node.condition.tokens)
+    if not is_literal:
+        return None
+    return bool(value)
+
+def is_removable(commands: list, start: int, end: int) -> bool:
+    """ Checks a range of operations can be removed (blocks are closed in the range and there is no label) """
+    depth = 0
+    for op in commands[start:end]:
+        if op['command'] == 'label' and op['file_path'] != '<system>':
+            return False
+        if op['command'] in ('if', 'while', 'try', 'namespace', 'ns', 'class', 'func'):
+            depth += 1
+        elif op['command'] in ('endif', 'endwhile', 'endtry', 'endnamespace', 'endns', 'endclass', 'endfunc'):
+            depth -= 1
+            if depth < 0:
+                return False
+    return depth == 0
+
+def remove_dead_branches(commands: list) -> list:
+    """ Removes body of the `if`, `elif` and `else` branches that never run
+
+    A branch never runs if its condition is a literal false value,
+    or condition of a previous branch is a literal true value.
+    The generated jumps and labels of the `if` are kept.
+    """
+    removed = set()
+    # open ifs: [<always-taken-branch-found>, <start-of-current-body>, <current-body-is-dead>]
+    ifs = []
+    for i in range(len(commands)):
+        op = commands[i]
+        if op['file_path'] == '<system>':
+            continue
+        command = op['command']
+        if command in ('if', 'elif', 'else', 'endif') and ifs:
+            if command != 'if':
+                # end of the previous branch
+                is_taken, start, is_dead = ifs[-1]
+                if is_dead and is_removable(commands, start, i):
+                    removed.update(range(start, i))
+        if command == 'if':
+            value = branch_value(commands, i)
+            ifs.append([value is False, i + 1, value is True])
+        elif command in ('elif', 'else') and ifs:
+            value = branch_value(commands, i + 2)
+            is_taken = ifs[-1][0]
+            ifs[-1] = [is_taken or value is False, i + 3, is_taken or value is True]
+        elif command == 'endif' and ifs:
+            ifs.pop()
+    if not removed:
+        return commands
+    return [commands[i] for i in range(len(commands)) if i not in removed]
+
+def remove_unreachable(commands: list) -> list:
+    """ Removes the simple operations (assignments, calls...) after `return` until end of the block or a label """
+    simple_opcodes = (
+        nodes.OP_ASSIGN, nodes.OP_INCREMENT, nodes.OP_CALL, nodes.OP_EXPR, nodes.OP_RETURN,
+        nodes.OP_INVOKE_CALL, nodes.OP_INVOKE_ASSIGN, nodes.OP_INVOKE_RETURN,
+    )
+    result = []
+    after_return = False
+    for op in commands:
+        node = op['node']
+        if after_return:
+            if op['file_path'] != '<system>' and node.opcode in simple_opcodes:
+                continue
+            if op['command'] == 'pass':
+                continue
+            after_return = False
+        result.append(op)
+        if isinstance(node, nodes.Return):
+            after_return = True
+    return result
+
+def hoist_invariants(commands: list) -> list:
+    """ Moves `len($var)` out of `while` conditions
+
+    `$__len_<var>_<line>__ = len($var)` is put before the `while` and the condition uses that.
+    This is done only if the loop body does not use `$var` and the body and the condition do not call anything
+    except the functions in `PURE_FUNCTIONS`.
+    `parser.make_jumps` should be run before this.
+    """
+    declared = set()
+    for op in commands:
+        if op['command'] == 'func' and op['args']:
+            declared.add(op['args'][0].split('(')[0].split('::')[-1].strip())
+    result = []
+    for i in range(len(commands)):
+        op = commands[i]
+        node = op['node']
+        if isinstance(node, nodes.While) and node.end is not None and 'len' not in declared:
+            tokens = node.condition.tokens
+            j = 0
+            while j + 3 < len(tokens):
+                if tokens[j] == ['o', 'len'] and tokens[j+1] == ['l', '('] and tokens[j+2][0] == 'v' and tokens[j+3] == ['l', ')']:
+                    name = tokens[j+2][1]
+                    if name.isidentifier() and is_pure_expr(tokens, declared) and is_invariant(commands[i+1:i+node.end], name, declared):
+                        var_name = '__len_' + name + '_' + str(op['line_number']) + '__'
+                        hoisted = parser.parse('$' + var_name + ' = len($' + name + ')', filepath=op['file_path'])[0]
+                        hoisted['line_number'] = op['line_number']
+                        result.append(hoisted)
+                        tokens = tokens[:j] + [['v', var_name, 'self.get_var("' + var_name + '")']] + tokens[j+4:]
+                        node.condition.tokens = tokens
+                j += 1
+        result.append(op)
+    return result
+
+def is_invariant(body: list, name: str, declared: set) -> bool:
+    """ Checks a loop body does not use a variable and does not call functions that may change that
+
+    Other variables may be aliases of the variable (`$c = $a`), then the bodies that change items or attributes,
+    use `->` or run `python()`/`eval()` are not invariant.
+    """
+    for op in body:
+        node = op['node']
+        if isinstance(node, nodes.Assign) and (node.name == name or node.kind in ('item', 'attr', 'python')):
+            return False
+        if isinstance(node, nodes.Call) and op['file_path'] != '<system>' and (node.name not in PURE_FUNCTIONS or node.name in declared):
+            return False
+        if not isinstance(node, (nodes.Assign, nodes.Call, nodes.ExprStatement, nodes.While, nodes.Return, nodes.Branch)) \
+                and node.opcode not in (nodes.OP_PASS, nodes.OP_ENDWHILE, nodes.OP_BREAK, nodes.OP_CONTINUE, nodes.OP_GOTO, nodes.OP_GOTOIF):
+            return False
+        if isinstance(node, nodes.Call):
+            # name of the function is checked above
+            exprs = [node.args]
+        else:
+            exprs = node_exprs(node)
+        if isinstance(node, nodes.Assign) and node.target is not None:
+            exprs.append(node.target)
+        for expr in exprs:
+            if not is_pure_expr(expr.tokens, declared, name):
+                return False
+    return True
+
+def is_pure_expr(tokens: list, declared: set, name=None) -> bool:
+    """ Checks a expression does not use the variable `name`, `->` or calls except the functions in `PURE_FUNCTIONS` """
+    for k in range(len(tokens)):
+        item = tokens[k]
+        if item[0] == 'v' and item[1] == name:
+            return False
+        if item == ['l', '.'] or item[-1] in ('python', 'eval'):
+            return False
+        if k + 1 == len(tokens) or tokens[k+1] != ['l', '(']:
+            continue
+        # the parentheses after this token may be a call
+        if item[0] == 'o' and (item[-1] in KEYWORD_OPERATORS or (item[-1] in PURE_FUNCTIONS and item[-1] not in declared)):
+            continue
+        if item[0] == 'l' and item[-1] not in (')', ']'):
+            continue
+        return False
+    return True
@@ -22,11 +22,10 @@
 
 ''' Pashmak syntax parser '''
 
-import random
-import time
-from .lexer import parse_op, parse_string
-
-rand_counter = 0
+from keyword import iskeyword
+from .lexer import parse_op, parse_string, parse_eval
+from .nodes import *
+from .nodes import COMMAND_OPCODES, OP_FUNC, OP_ENDFUNC, OP_WHILE, OP_ENDWHILE, OP_BREAK, OP_CONTINUE, OP_GOTO, OP_GOTOIF, OP_TRY, OP_PASS, OP_BRANCH
 
 def parse(content: str, filepath='<system>', only_parse=False, no_random=False) -> list:
     """ Parse code from text and return list of commands
@@ -37,7 +36,7 @@ def parse(content: str, filepath='<system>', only_parse=False, no_random=False)
         content(str): The code you want to parse
         filepath(str): The file path you loaded file from
         only_parse(bool): if is True, do not parses `if` statement(default is False)
-        no_random(bool): do not generate random names for if sections
+        no_random(bool): not used (names of the labels of the if sections are not random anymore, it is kept for compatibility)
 
     Return:
         Returns a list:
@@ -49,6 +48,8 @@ def parse(content: str, filepath='<system>', only_parse=False, no_random=False)
         ]
     
     Handles multiline and if statements.
+    Names of the labels that the if sections are converted to are made by count of the ifs,
+    then same code is always parsed to same commands.
     """
     # split the lines
     lines = content.split('\n')
@@ -161,8 +162,6 @@ def parse(content: str, filepath='<system>', only_parse=False, no_random=False)
                 op = parse_op(op)
                 op['line_number'] = line_counter
                 op['file_path'] = filepath
-                if op['command'] == 'label' and only_parse == False:
-                    commands.append(parse_op('pass'))
                 commands.append(op)
         line_counter += 1
 
@@ -188,18 +187,14 @@ def parse(content: str, filepath='<system>', only_parse=False, no_random=False)
     # handle the if statement
     open_ifs = []
     open_ifs_counters = []
+    ifs_count = 0
     i = 0
     while i < len(commands):
         try:
             if commands[i]['command'] == 'if':
                 # init new if block
-                if no_random:
-                    global rand_counter
-                    rand_name = str(rand_counter) + '_'
-                    rand_counter += 1
-                else:
-                    rand_name = str(random.random()).replace('.', '') + str(time.time()).replace('.', '') + '_'
-                open_ifs.append('tmplabelif' + rand_name)
+                open_ifs.append('tmplabelif' + str(ifs_count) + '_')
+                ifs_count += 1
                 open_ifs_counters.append(2)
 
                 commands.insert(i+1, parse_op('mem not (' + commands[i]['args_str'] + ')', file_path='<system>', line_number=i))
@@ -225,8 +220,229 @@ def parse(content: str, filepath='<system>', only_parse=False, no_random=False)
             commands.insert(i+1, parse_op('endif', file_path='<system>', line_number=i))
         i += 1
 
+    for op in commands:
+        op['node'] = make_node(op)
+    commands = fuse_ops(commands)
+    make_invokes(commands)
+    make_jumps(commands)
+
     return commands
 
+def make_jumps(commands: list):
+    """ Finds the jump targets of the commands
+
+    Sets distance of `while` to the matching `endwhile` (and reverse),
+    distance of `break` and `continue` to the loop
+    and distance of `goto`, `gotoif` and `try` to the label on the nodes.
+    The distances are relative, then they are still valid in
+    function bodies (that are a slice of the parsed code).
+
+    Args:
+        commands(list): the parsed code (nodes should be made)
+    """
+    # each function body is a separated scope
+    # scope: [open loops, declared labels, index of the jumps to labels]
+    scopes = [[[], {}, []]]
+    i = 0
+    while i < len(commands):
+        node = commands[i]['node']
+        opcode = node.opcode
+        loops, labels, jumps = scopes[-1]
+        if opcode == OP_FUNC:
+            scopes.append([[], {}, []])
+        elif opcode == OP_ENDFUNC:
+            if len(scopes) > 1:
+                link_labels(commands, *scopes.pop()[1:])
+        elif opcode == OP_WHILE:
+            # [index of while, list of breaks]
+            loops.append([i, []])
+        elif opcode == OP_ENDWHILE:
+            if loops:
+                start, breaks = loops.pop()
+                node.start = start - i
+                commands[start]['node'].end = i - start
+                for index in breaks:
+                    commands[index]['node'].end = i - index
+        elif opcode == OP_BREAK:
+            if loops:
+                loops[-1][1].append(i)
+        elif opcode == OP_CONTINUE:
+            if loops:
+                node.start = loops[-1][0] - i
+        elif opcode in (OP_GOTO, OP_GOTOIF, OP_TRY, OP_BRANCH):
+            jumps.append(i)
+        elif commands[i]['command'] == 'label' and commands[i]['args']:
+            labels[commands[i]['args'][0]] = i
+        i += 1
+    for scope in scopes:
+        link_labels(commands, *scope[1:])
+
+def is_system_op(commands: list, index: int, command: str) -> bool:
+    """ Checks the operation at the index is generated by the parser (for `if` blocks) """
+    return index < len(commands) and commands[index]['file_path'] == '<system>' and commands[index]['command'] == command
+
+def fuse_ops(commands: list) -> list:
+    """ Replaces the frequent sequences of operations with single operations (superinstructions)
+
+    - `if` and its `mem not (<condition>)` and `gotoif <label>` are fused into a `Branch` node
+    - `mem not (<condition>)` and `gotoif <label>` of `elif` and `else` are fused into a `Branch` node
+    - `elif` and `else` get the `goto <end-label>` after them (as a `Goto` node)
+    - `$<name> = $<name> + <number>` (and `-`) is changed to a `Increment` node
+
+    Then a `if` block runs with half of the operations.
+    Nodes should be made before this and the jumps are made after this.
+
+    Args:
+        commands(list): the parsed code
+
+    Return:
+        list: the new list of the operations
+    """
+    result = []
+    i = 0
+    while i < len(commands):
+        op = commands[i]
+        node = op['node']
+        if op['command'] == 'if' and node.opcode == OP_PASS and is_system_op(commands, i+1, 'mem') and is_system_op(commands, i+2, 'gotoif'):
+            op['node'] = Branch('if', commands[i+2]['node'].label, None, commands[i+1]['node'].args)
+            i += 2
+        elif op['command'] in ('elif', 'else') and node.opcode == OP_PASS and is_system_op(commands, i+1, 'goto'):
+            op['node'] = Goto(op['command'], commands[i+1]['node'].label, None)
+            i += 1
+        elif is_system_op(commands, i, 'mem') and is_system_op(commands, i+1, 'gotoif'):
+            op['node'] = Branch('mem', commands[i+1]['node'].label, None, node.args)
+            i += 1
+        elif type(node) is Assign and node.kind == 'var' and node.value is not None:
+            tokens = node.value.tokens
+            if len(tokens) == 3 and tokens[0][:2] == ['v', node.name] and tokens[1] in (['l', '+'], ['l', '-']) \
+                    and tokens[2][0] == 'o' and tokens[2][1].isdecimal() and str(int(tokens[2][1])) == tokens[2][1]:
+                step = int(tokens[2][1])
+                if tokens[1][1] == '-':
+                    step = -step
+                op['node'] = Increment(node.kind, node.name, node.target, node.value, step)
+        result.append(op)
+        i += 1
+    return result
+
+def call_arguments(tokens: list):
+    """ Returns the arguments expression of a function call expression (`f(<arguments>)`)
+
+    The result is a `__call_args__(<arguments>)` expression,
+    None is returned if the tokens are not only a call of a name.
+    """
+    if len(tokens) < 3 or tokens[0][0] != 'o' or tokens[1] != ['l', '('] or tokens[-1] != ['l', ')']:
+        return None
+    name = tokens[0][1]
+    if iskeyword(name) or not all(part.isidentifier() for part in name.split('.')):
+        return None
+    depth = 0
+    for i in range(1, len(tokens)):
+        if tokens[i][0] != 'l':
+            continue
+        depth += tokens[i][1].count('(') - tokens[i][1].count(')')
+        if depth <= 0 and i != len(tokens)-1:
+            # the parentheses of the arguments are closed before the end
+            return None
+    return Expr([['n', '__call_args__']] + tokens[1:])
+
+def make_invokes(commands: list):
+    """ Changes the calls of a name (`f(...)`, `$<name> = f(...)` and `return f(...)`) to `Invoke` nodes
+
+    Then if the name is a Pashmak function, the call is run by the loop of the interpreter
+    and python calls are not nested for it (see `Program.run_invoke`).
+    """
+    for op in commands:
+        node = op['node']
+        if type(node) is Call:
+            arguments = call_arguments(node.call.tokens)
+            if arguments is not None and node.call.tokens[0][1] == node.name:
+                op['node'] = InvokeCall(node.name, node.args, node.has_args, node.call, node.expr, node.name, arguments)
+        elif type(node) is Assign and node.kind == 'var' and node.value is not None:
+            arguments = call_arguments(node.value.tokens)
+            if arguments is not None:
+                op['node'] = InvokeAssign(node.kind, node.name, node.target, node.value, node.value.tokens[0][1], arguments)
+        elif type(node) is Return and node.value is not None:
+            arguments = call_arguments(node.value.tokens)
+            if arguments is not None:
+                op['node'] = InvokeReturn(node.command, node.value, node.value.tokens[0][1], arguments)
+
+def link_labels(commands: list, labels: dict, jumps: list):
+    """ Sets distance of the jumps (`goto`, `gotoif`, `try`) to their label
+
+    Jumps to undefined labels keep `offset` as None
+    and raise LabelError while running.
+    """
+    for index in jumps:
+        node = commands[index]['node']
+        try:
+            node.offset = labels[node.label] - index
+        except KeyError:
+            pass
+
+def make_node(op: dict):
+    """ Classifies a operation and returns the syntax tree node of that
+
+    Args:
+        op(dict): output of `lexer.parse_op`
+
+    Return:
+        A object from one of the classes in `nodes` module
+    """
+    command = op['command']
+    if command in COMMAND_OPCODES:
+        if command == 'while':
+            return While(command, Expr(op['args_eval']), None)
+        if command == 'endwhile':
+            return EndWhile(command, None)
+        if command == 'break':
+            return Break(command, None)
+        if command == 'continue':
+            return Continue(command, None)
+        if command == 'return':
+            if op['args_str'].strip() == '':
+                return Return(command, None)
+            return Return(command, Expr(op['args_eval']))
+        if command in ('goto', 'gotoif', 'try'):
+            label = None
+            if op['args']:
+                label = op['args'][0]
+            return {'goto': Goto, 'gotoif': GotoIf, 'try': Try}[command](command, label, None)
+        return Statement(COMMAND_OPCODES[command], command)
+
+    if op['str'][0] == '$':
+        parts = split_by_equals(op['strings'])
+        if len(parts) <= 1:
+            if '->' in op['str'] or '(' in op['str'] or ')' in op['str']:
+                return ExprStatement(Expr(op['eval']))
+        varname = parts[0].strip()
+        value = None
+        if len(parts) > 1:
+            value = Expr(parse_eval(parts[1].strip()))
+        tmp = varname.split('->', 1)
+        if len(tmp) > 1 and value != None:
+            return Assign('attr', tmp[0][1:], Target(parse_eval(varname)), value)
+        if value != None and ('[' in varname or ']' in varname):
+            return Assign('item', varname[1:], Target(parse_eval(varname)), value)
+        return Assign('var', varname[1:], None, value)
+
+    parts = split_by_equals(op['strings'])
+    if len(parts) > 1:
+        return Assign('python', None, Target(parse_eval(parts[0])), Expr(parse_eval(parts[1])))
+
+    args_str = op['args_str'].strip()
+    if args_str:
+        if args_str[0] != '(':
+            args_str = '(' + args_str + ')'
+    else:
+        args_str = '()'
+    return Call(
+        command,
+        Expr(op['args_eval']),
+        op['args_str'] != '' and op['args_str'].strip() != '()',
+        Expr(parse_eval(command + args_str)),
+        Expr(op['eval']),
+    )
+
 def split_by_equals(string: str) -> list:
     """ Parses `<something> = <something>`
 
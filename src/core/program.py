@@ -26,10 +26,13 @@ import sys
 import os
 import signal
 import copy
+import importlib
+from collections import OrderedDict
 from pathlib import Path
-from . import helpers, version, modules, jit, parser, current_prog, lexer
+from . import helpers, version, modules, jit, parser, current_prog, lexer, nodes, native
 from .class_system import Class, ClassObject
-from .function import Function
+from .function import Function, MISSING
+from .frame import Frame, Locals, UNSET
 
 import hashlib, time, random, datetime, base64, json
 import http, http.cookies, http.server, http.client, http.cookiejar, socket, socketserver
@@ -44,33 +47,112 @@ def free(name):
     except KeyError:
         pass
 
+class NameTable(dict):
+    """ A dict of declared names (functions, classes, defines)
+
+    Tracks a version number that changes on every mutation,
+    Then the eval cache knows when name resolution should be done again.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = 0
+
+    def __setitem__(self, key, value):
+        self.version += 1
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self.version += 1
+        super().__delitem__(key)
+
+    def pop(self, *args):
+        self.version += 1
+        return super().pop(*args)
+
+    def popitem(self):
+        self.version += 1
+        return super().popitem()
+
+    def setdefault(self, key, default=None):
+        self.version += 1
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        self.version += 1
+        super().update(*args, **kwargs)
+
+    def clear(self):
+        self.version += 1
+        super().clear()
+
+def call_args(*args, **kwargs) -> tuple:
+    """ Returns the arguments of a call as (<args>, <kwargs>) (`__call_args__` of the evals, see `nodes.Invoke`) """
+    return args, kwargs
+
+class HandledError(BaseException):
+    """ Unwinds the python calls of the frames that are popped by a handled error
+
+    This is raised when a error is handled by a `try` of a outer frame,
+    and is caught by the `run_frame` (or `run_native`) that runs the frame of the `try`.
+    This is not a `Exception` (like `SystemExit`), then `except Exception` of the python code does not catch that.
+    """
+    pass
+
+class CaughtError:
+    """ Data of a error that is caught by a `try` block
+
+    This is put in mem when the error is raised and the `Error` object
+    is only made when the handler reads the mem (`^`), see `Program.get_mem`.
+    """
+    __slots__ = ('type', 'message', 'file_path', 'line_number')
+
+    def __init__(self, error_type: str, message: str, file_path: str, line_number: int):
+        self.type = error_type
+        self.message = message
+        self.file_path = file_path
+        self.line_number = line_number
+
+    def make_object(self, prog):
+        """ Makes the `Error` object of the error """
+        error = prog.classes['Error'].make_object(prog)
+        error.type = self.type
+        error.message = self.message
+        error.file_path = self.file_path
+        error.line_number = self.line_number
+        return error
+
 class Program(helpers.Helpers):
     """ Pashmak program object """
+    EVAL_CACHE_SIZE = 4096 # maximum count of cached compiled evals
+    PARSE_CACHE_SIZE = 128 # maximum count of cached parsed codes of `eval()` (0 disables the cache)
+    PYTHON_CACHE_SIZE = 256 # maximum count of cached compiled codes of `python()` (least recently used code is removed)
+    FRAME_INHERITED_VARS = ('argv', 'argc', '__file__', '__dir__', '__ismain__') # variables that a function frame gets from the caller
+    NATIVE_CALLS_THRESHOLD = 10 # count of calls that a function is compiled by the native tier after (None disables the native tier)
+    NATIVE_LOOP_THRESHOLD = 100 # count of jumps back that a loop of the main code is compiled after (None disables compiling loops)
+    TYPED_ITEMS_LIMIT = None # count of the first items of a typed list argument that are validated (None validates all of the items)
+    MAX_DEPTH = 100000 # maximum count of the frames, a deeper call raises RecursionError
+    NATIVE_DEPTH_LIMIT = 100 # count of the frames that functions are not run by the native tier after (the native tier nests python calls)
+    TAIL_CALLS = True # `return f(...)` reuses the frame of the caller (False keeps all of the frames for debugging)
+
     def __init__(self, is_test=False, args=[]):
-        self.frames = [{
-            'current_step': 0,
-            'commands': [parser.parse('pass')[0]],
-            'used_namespaces': [],
-            'imported_modules': [],
-            'vars': {
-                'argv': args,
-                'argc': len(args)
-            }
-        }] # list of frames
-        self.functions = {
+        self.frames = [Frame([parser.parse('pass')[0]], {
+            'argv': args,
+            'argc': len(args)
+        })] # list of frames
+        self.functions = NameTable({
             "mem": Function(name='mem'), # mem is a empty function just for save mem in code
             "rmem": Function(name='rmem'),
-        } # declared functions <function-name>:[<list-of-body-commands>]
-        self.labels = {} # list of declared label <label-name>:<index-of-command-to-jump>
-        self.classes = {} # list of declared classes
+        }) # declared functions <function-name>:[<list-of-body-commands>]
+        self.classes = NameTable() # list of declared classes
         self.imported_files = [] # list of imported files
         self.mem = None # memory temp value
         self.is_test = is_test # program is in testing state
         self.output = '' # program output (for testing state)
         self.runtime_error = None # program raised error (for testing state)
-        self.try_endtry = [] # says program is in try-endtry block
+        self.try_endtry = [] # opened try blocks (frame, index of the label)
         self.namespaces_tree = [] # namespaces tree
         self.included_modules = [] # list of included modules to stop repeating imports
+        self.code_locations = {} # cached absolute path and directory of code files <file-path>:(<abspath>, <dir>)
 
         self.allowed_pashmak_extensions = ['pashm']
 
@@ -88,16 +170,88 @@ class Program(helpers.Helpers):
         self.module_path = []
 
         self.last_docstring = ''
+        self.last_memo = None # cache of the next declared function (see `run_atmemo`)
 
         self.shutdown_event = []
 
-        self.defines = {}
+        self.defines = NameTable()
+
+        self.eval_cache = {} # compiled code objects of evals <key>:[<source>, <resolve-key>, <code>]
+        self.eval_cache_hits = 0
+        self.eval_cache_misses = 0
+        self.python_cache = OrderedDict() # compiled codes of `python()` <source>:<code>
+        self.python_cache_hits = 0
+        self.python_cache_misses = 0
+        self.python_modules = {} # modules loaded by `py_load_module` <name>:<module>
+        self.parse_cache = OrderedDict() # parsed codes of `eval()` <source>:<commands> (see `parse_eval_code`)
+        self.parse_cache_hits = 0
+        self.parse_cache_misses = 0
+        # `PASHMAK_PARSE_CACHE_SIZE` environment variable changes the size
+        self.parse_cache_size = self.PARSE_CACHE_SIZE
+        try:
+            self.parse_cache_size = int(os.environ['PASHMAK_PARSE_CACHE_SIZE'])
+        except (KeyError, ValueError):
+            pass
+        self.type_cache = {} # resolved names of the types in type definations <key>:(<is-class>, <class-real-name-or-python-type>)
+        # `PASHMAK_TYPED_ITEMS_LIMIT` environment variable changes the limit
+        self.typed_items_limit = self.TYPED_ITEMS_LIMIT
+        try:
+            self.typed_items_limit = int(os.environ['PASHMAK_TYPED_ITEMS_LIMIT'])
+        except (KeyError, ValueError):
+            pass
+        # `PASHMAK_NO_TAIL_CALLS` environment variable disables the tail calls
+        self.tail_calls = self.TAIL_CALLS and not os.environ.get('PASHMAK_NO_TAIL_CALLS')
+        self.eval_scope = {
+            'self': self,
+            'true': True,
+            'false': False,
+            'null': None,
+            'string': str,
+            'integer': int,
+            'array': list,
+            '__unset__': UNSET,
+            '__call_args__': call_args,
+        } # names accessible in evals
+        # globals of the functions compiled by the native tier
+        self.native_scope = dict(globals())
+        self.native_scope.update(self.eval_scope)
+        del self.native_scope['self']
+
+        # the opcode handlers
+        self.dispatch = [None] * nodes.OPCODES_COUNT
+        self.dispatch[nodes.OP_PASS] = self.run_pass
+        self.dispatch[nodes.OP_FUNC] = self.run_func
+        self.dispatch[nodes.OP_ENDFUNC] = self.run_endfunc
+        self.dispatch[nodes.OP_CLASS] = self.run_class
+        self.dispatch[nodes.OP_ENDCLASS] = self.run_endclass
+        self.dispatch[nodes.OP_ASSIGN] = self.run_assign
+        self.dispatch[nodes.OP_CALL] = self.run_call
+        self.dispatch[nodes.OP_EXPR] = self.run_expr
+        self.dispatch[nodes.OP_WHILE] = self.run_while
+        self.dispatch[nodes.OP_ENDWHILE] = self.run_endwhile
+        self.dispatch[nodes.OP_BREAK] = self.run_break
+        self.dispatch[nodes.OP_CONTINUE] = self.run_continue
+        self.dispatch[nodes.OP_GOTO] = self.run_goto
+        self.dispatch[nodes.OP_GOTOIF] = self.run_gotoif
+        self.dispatch[nodes.OP_TRY] = self.run_try
+        self.dispatch[nodes.OP_ENDTRY] = self.run_endtry
+        self.dispatch[nodes.OP_RETURN] = self.run_return
+        self.dispatch[nodes.OP_NAMESPACE] = self.run_namespace
+        self.dispatch[nodes.OP_ENDNAMESPACE] = self.run_endnamespace
+        self.dispatch[nodes.OP_USE] = self.run_use
+        self.dispatch[nodes.OP_DOC] = self.run_atdoc
+        self.dispatch[nodes.OP_MEMO] = self.run_atmemo
+        self.dispatch[nodes.OP_INCREMENT] = self.run_increment
+        self.dispatch[nodes.OP_BRANCH] = self.run_branch
+        self.dispatch[nodes.OP_INVOKE_CALL] = self.run_invoke
+        self.dispatch[nodes.OP_INVOKE_ASSIGN] = self.run_invoke
+        self.dispatch[nodes.OP_INVOKE_RETURN] = self.run_invoke
 
         current_prog.current_prog = self
 
     def import_script(self, paths, import_once=False, ismain_default=False):
         """ Imports scripts/modules """
-        op = self.frames[-1]['commands'][self.frames[-1]['current_step']]
+        op = self.frames[-1].commands[self.frames[-1].current_step]
 
         if type(paths) == str:
             paths = [paths]
@@ -116,7 +270,7 @@ class Program(helpers.Helpers):
                     is_currently_imported = False
                     z = len(self.frames)-1
                     while z >= 0:
-                        if namespaces_prefix + module_name in self.frames[z]['imported_modules']:
+                        if namespaces_prefix + module_name in self.frames[z].imported_modules:
                             is_currently_imported = True
                             z = -1
                         z -= 1
@@ -143,7 +297,7 @@ class Program(helpers.Helpers):
                             if commands == False:
                                 raise KeyError()
                         # add this module to imported modules
-                        self.frames[-1]['imported_modules'].append(namespaces_prefix + module_name)
+                        self.frames[-1].imported_modules.append(namespaces_prefix + module_name)
                     else:
                         return
                 except KeyError:
@@ -153,7 +307,7 @@ class Program(helpers.Helpers):
                 is_currently_imported = False
                 z = len(self.frames) - 1
                 while z >= 0:
-                    if namespaces_prefix + os.path.abspath(path) in self.frames[z]['imported_modules']:
+                    if namespaces_prefix + os.path.abspath(path) in self.frames[z].imported_modules:
                         is_currently_imported = True
                         z = -1
                     z -= 1
@@ -164,7 +318,7 @@ class Program(helpers.Helpers):
                 try:
                     code_location = path
                     commands = jit.load(path, code_location, self, ismain_default=ismain_default)
-                    self.frames[-1]['imported_modules'].append(namespaces_prefix + os.path.abspath(path))
+                    self.frames[-1].imported_modules.append(namespaces_prefix + os.path.abspath(path))
                 except FileNotFoundError as ex:
                     return self.raise_error('FileError', str(ex), op)
                 except PermissionError as ex:
@@ -181,46 +335,41 @@ class Program(helpers.Helpers):
         self.set_var('__ismain__', True)
         self.import_script('@stdlib')
         # set commands on program object
-        self.frames[-1]['commands'] = commands
+        self.frames[-1].commands = commands
 
     def get_mem(self):
         """ Return memory value and empty that """
         mem = self.mem
         self.mem = None
+        if type(mem) is CaughtError:
+            return mem.make_object(self)
         return mem
 
     def raise_error(self, error_type: str, message: str, op=None):
         """ Raise error in program """
         if op is None:
-            op = self.frames[-1]['commands'][self.frames[-1]['current_step']]
+            op = self.frames[-1].commands[self.frames[-1].current_step]
         # check is in try
         if self.try_endtry:
-            label_index = self.try_endtry[-1]
-            self.try_endtry.pop()
-            new_step = self.labels[str(label_index)]
-            while True:
-                try:
-                    if self.frames[-1]['commands'][new_step-1]['command'] == 'pass':
-                        self.frames[-1]['current_step'] = new_step-1
-                        break
-                    else:
-                        self.frames.pop()
-                except:
-                    self.frames.pop()
+            frame, new_step = self.try_endtry.pop()
+            # back to the frame which try block is opened in
+            unwind = self.frames[-1] is not frame
+            while len(self.frames) > 1 and self.frames[-1] is not frame:
+                self.frames.pop()
+            self.frames[-1].current_step = new_step
 
-            # put error data in mem
-            self.mem = copy.deepcopy(self.classes['Error'])
-            self.mem.type = error_type
-            self.mem.message = message
-            self.mem.file_path = op['file_path']
-            self.mem.line_number = op['line_number']
+            # put error data in mem (the `Error` object is made when it is read)
+            self.mem = CaughtError(error_type, message, op['file_path'], op['line_number'])
+            if unwind:
+                # the python calls of the popped frames should not be continued
+                raise HandledError()
             return
         # raise error
         if self.is_test:
             self.runtime_error = {'type': error_type, 'message': message}
             if self.stop_after_error:
                 self.frames = self.frames[:1]
-                self.frames[-1]['current_step'] = len(self.frames[-1]['commands'])*2
+                self.frames[-1].current_step = len(self.frames[-1].commands)*2
             return
 
         # check HIDE_ERRORS config
@@ -239,20 +388,8 @@ class Program(helpers.Helpers):
             except:
                 pass
             print(error_type + ': ' + message + ':')
-            last_frame = self.frames[0]
-            for frame in self.frames[1:]:
-                try:
-                    if last_frame:
-                        tmp_op = last_frame['commands'][last_frame['current_step']]
-                    else:
-                        tmp_op = frame['commands'][0]
-                    print(
-                        '  in ' + tmp_op['file_path'] + ':' + str(tmp_op['line_number'])\
-                        + ':\n\t' + tmp_op['str']
-                    )
-                except KeyError:
-                    pass
-                last_frame = frame
+            for entry in self.traceback_entries():
+                print(entry)
             print('  in ' + op['file_path'] + ':' + str(op['line_number']) + ':\n\t' + op['str'])
             if self.frames[1:]:
                 print(error_type + ': ' + message + '.')
@@ -263,43 +400,129 @@ class Program(helpers.Helpers):
                 pass
         sys.exit(1)
 
-    def exec_func(self, func_body: list, with_frame=True, default_variables={}):
-        """ Gets a list from commands and runs them as function or included script """
-        old_dir = self.get_var('__dir__')
-        old_file = self.get_var('__file__')
-        # create new frame for this call
+    def traceback_entries(self) -> list:
+        """ Returns the lines of the traceback for the frames (the call operation of each frame)
+
+        Consecutive same entries (recursions) are shown once and count of the repeats is shown after that.
+        """
+        entries = []
+        repeats = 0
+        last_frame = self.frames[0]
+        for frame in self.frames[1:]:
+            try:
+                if last_frame:
+                    tmp_op = last_frame.commands[last_frame.current_step]
+                else:
+                    tmp_op = frame.commands[0]
+                entry = '  in ' + tmp_op['file_path'] + ':' + str(tmp_op['line_number']) + ':\n\t' + tmp_op['str']
+                if entries and entries[-1] == entry and not frame.tail_calls:
+                    repeats += 1
+                else:
+                    if repeats:
+                        entries.append('  [previous frame repeated ' + str(repeats) + ' more times]')
+                        repeats = 0
+                    entries.append(entry)
+            except KeyError:
+                pass
+            if frame.tail_calls:
+                entries.append('  ... ' + str(frame.tail_calls) + ' frame(s) elided by tail calls')
+            last_frame = frame
+        if repeats:
+            entries.append('  [previous frame repeated ' + str(repeats) + ' more times]')
+        return entries
+
+    def exec_func(self, func_body: list, with_frame=True, default_variables={}, namespace='', slot_map=None, func=None):
+        """ Gets a list from commands and runs them as function or included script
+
+        `func_body` is not changed, then that can be shared between the frames.
+        If `namespace` is given, that namespace is used in the new frame.
+        If `slot_map` is given, local variables of the new frame are kept in slots (see `frame.Locals`).
+        If `func` (the called function object) is given, the function may be run by the native tier (see `native.py`).
+        """
+        if not with_frame:
+            # the frame shares variables with the current frame, they should be restored after running
+            old_dir = self.get_var('__dir__')
+            old_file = self.get_var('__file__')
+        self.push_frame(func_body, with_frame, default_variables, namespace, slot_map)
+
+        # run function
+        native_code = None
+        if func is not None and with_frame and not self.namespaces_tree:
+            native_code = native.get_native(self, func)
         if with_frame:
-            frame_vars = dict(self.frames[0]['vars'])
-            for k in self.all_vars():
-                if k in ['argv', 'argc', '__file__', '__dir__', '__ismain__']:
-                    frame_vars[k] = copy.deepcopy(self.get_var(k))
+            if native_code is None:
+                self.start_frame()
+            else:
+                self.run_native(native_code)
+            return
+        try:
+            self.start_frame()
+        finally:
+            self.set_var('__dir__', old_dir)
+            self.set_var('__file__', old_file)
+
+    def push_frame(self, func_body: list, with_frame=True, default_variables={}, namespace='', slot_map=None):
+        """ Creates the frame of a function call or included script (see `exec_func`) and pushes it to the frames """
+        if with_frame:
+            frame_vars = self.frame_vars(func_body, self.frames[-1].vars, default_variables, slot_map)
             imported_modules = []
         else:
-            frame_vars = self.frames[-1]['vars']
-            imported_modules = self.frames[-1]['imported_modules']
+            frame_vars = self.frames[-1].vars
+            imported_modules = self.frames[-1].imported_modules
+            for k in default_variables:
+                frame_vars[k] = default_variables[k]
+            self.set_file_vars(frame_vars, func_body)
+        used_namespaces = []
+        if not with_frame:
+            used_namespaces = self.frames[-1].used_namespaces
+        if namespace:
+            used_namespaces.append(namespace)
+            self.reset_var_keys()
+        self.frames.append(Frame(func_body, frame_vars, used_namespaces, imported_modules))
 
+    def frame_vars(self, func_body: list, caller_vars, default_variables: dict, slot_map=None):
+        """ Makes the variables of a isolated frame (function call)
+
+        Only local variables are kept in the frame, globals are read from the first frame.
+        """
+        if slot_map:
+            frame_vars = Locals(slot_map)
+        else:
+            frame_vars = {}
+        for k in self.FRAME_INHERITED_VARS:
+            try:
+                frame_vars[k] = caller_vars[k]
+            except KeyError:
+                pass
         for k in default_variables:
             frame_vars[k] = default_variables[k]
+        self.set_file_vars(frame_vars, func_body)
+        return frame_vars
+
+    def set_file_vars(self, frame_vars, func_body: list):
+        """ Sets `__file__` and `__dir__` of a frame to location of its code """
         if func_body:
-            frame_vars['__file__'] = os.path.abspath(func_body[0]['file_path'])
-            if os.path.isfile(frame_vars['__file__']):
-                frame_vars['__dir__'] = os.path.dirname(frame_vars['__file__'])
-        used_namespaces = []
-        if not with_frame:
-            used_namespaces = self.frames[-1]['used_namespaces']
-        self.frames.append({
-            'current_step': 0,
-            'commands': func_body,
-            'vars': frame_vars,
-            'used_namespaces': used_namespaces,
-            'imported_modules': imported_modules,
-        })
+            file_path, dir_path = self.code_location(func_body[0]['file_path'])
+            frame_vars['__file__'] = file_path
+            if dir_path is not None:
+                frame_vars['__dir__'] = dir_path
 
-        # run function
-        self.start_frame()
+    def code_location(self, file_path: str):
+        """ Returns absolute path and directory of a code file
 
-        self.set_var('__dir__', old_dir)
-        self.set_var('__file__', old_file)
+        Directory is None if the file does not exist (like `<eval>`).
+        Results are cached, then file system is checked only once for each file.
+        """
+        try:
+            return self.code_locations[file_path]
+        except KeyError:
+            pass
+        abs_path = os.path.abspath(file_path)
+        dir_path = None
+        if os.path.isfile(abs_path):
+            dir_path = os.path.dirname(abs_path)
+        location = self.code_locations[file_path] = (abs_path, dir_path)
+        return location
 
     def get_func_real_name(self, name: str):
         """ Returns function real name """
@@ -309,7 +532,7 @@ class Program(helpers.Helpers):
             real_name = self.current_namespace() + name
         except KeyError:
             func_body = False
-            for used_namespace in self.frames[-1]['used_namespaces']:
+            for used_namespace in self.frames[-1].used_namespaces:
                 try:
                     func_body = self.functions[used_namespace + '.' + name]
                     real_name = used_namespace + '.' + name
@@ -331,7 +554,7 @@ class Program(helpers.Helpers):
             real_name = self.current_namespace() + name
         except KeyError:
             class_body = False
-            for used_namespace in self.frames[-1]['used_namespaces']:
+            for used_namespace in self.frames[-1].used_namespaces:
                 try:
                     class_body = self.classes[used_namespace + '.' + name]
                     real_name = used_namespace + '.' + name
@@ -345,62 +568,216 @@ class Program(helpers.Helpers):
                     real_name = False
         return real_name
 
-    def eval(self, command, only_parse=False, dont_check_vars=False):
-        """ Runs eval on command """
-        if type(command) == str:
-            result = lexer.parse_eval(command)
-        else:
-            result = command
+    def resolve_eval(self, tokens: list, slot_map=None) -> str:
+        """ Converts the lexed eval tokens to python code
 
-        for i in range(0, len(result)):
-            if result[i][0] == 'o':
-                func_name = self.get_func_real_name(result[i][-1])
+        Names of functions, classes and defines will be resolved here
+        (tokens are not changed, because they may be shared between frames).
+        If `slot_map` is given, the local variables are read from the slots of the frame.
+        """
+        py_op = ''
+        for item in tokens:
+            code = item[-1]
+            if item[0] == 'v' and slot_map and item[1] in slot_map:
+                slot = '__locals__[' + str(slot_map[item[1]]) + ']'
+                code = '(' + slot + ' if ' + slot + ' is not __unset__ else ' + code + ')'
+            elif item[0] == 'o':
+                func_name = self.get_func_real_name(code)
                 if func_name != False:
-                    result[i][-1] = 'self.functions["' + func_name + '"]'
+                    code = 'self.functions["' + func_name + '"]'
                 else:
-                    class_name = self.get_class_real_name(result[i][-1])
+                    class_name = self.get_class_real_name(code)
                     if class_name != False:
-                        result[i][-1] = 'self.classes["' + class_name + '"]'
-                    else:
-                        try:
-                            self.defines[result[i][-1]]
-                            result[i][-1] = 'self.defines["' + result[i][-1] + '"]'
-                        except:
-                            pass
-
-        py_op = ''
-        for item in result:
+                        code = 'self.classes["' + class_name + '"]'
+                    elif code in self.defines:
+                        code = 'self.defines["' + code + '"]'
             if item[0] in ('n', 'o', 'v'):
-                py_op += item[-1] + ' '
+                py_op += code + ' '
             else:
-                py_op += item[-1]
+                py_op += code
+        return py_op
+
+    def frame_resolve_key(self) -> tuple:
+        """ Returns the state of the current frame that evals are resolved by (namespaces and local variable slots) """
+        frame = self.frames[-1]
+        frame_key = frame.resolve_key
+        if frame_key is None:
+            slot_map = None
+            if type(frame.vars) is Locals:
+                slot_map = frame.vars.slot_map
+            frame_key = frame.resolve_key = (
+                tuple(self.namespaces_tree),
+                tuple(frame.used_namespaces),
+                id(slot_map),
+                slot_map,
+            )
+        return frame_key
+
+    def resolve_type(self, name: str) -> tuple:
+        """ Resolves a type name of the type definations (like `int` or `SomeClass`)
+
+        Returns (True, <class-real-name>) for classes and (False, <value-of-the-name>) for the others.
+        The result is cached until the name resolution changes.
+        """
+        frame_key = self.frame_resolve_key()
+        key = (name, self.functions.version, self.classes.version, self.defines.version, frame_key[0], frame_key[1])
+        try:
+            return self.type_cache[key]
+        except KeyError:
+            pass
+        real_name = self.get_class_real_name(name)
+        if real_name != False:
+            result = (True, real_name)
+        else:
+            result = (False, self.eval(name))
+        if len(self.type_cache) >= self.EVAL_CACHE_SIZE:
+            self.type_cache.clear()
+        self.type_cache[key] = result
+        return result
+
+    def compile_eval(self, command, mode='eval', template='{}'):
+        """ Returns the compiled code object of a eval
+
+        The code is compiled only once and reused
+        until the name resolution (functions, classes, defines and namespaces) changes.
+        For `nodes.Expr` objects, the code is kept on the object itself,
+        and other commands (the tokens list or the string) are cached in `self.eval_cache`.
+
+        Args:
+            command(str|list|nodes.Expr): the eval code, output of `lexer.parse_eval` or the expression node
+            mode(str): compile mode, `eval` or `exec` (not used for `nodes.Expr`)
+            template(str): the generated python code will be put in this template (not used for `nodes.Expr`)
+        """
+        frame_key = self.frame_resolve_key()
+        slot_map = frame_key[3]
+        resolve_key = (
+            self.functions.version,
+            self.classes.version,
+            self.defines.version,
+            frame_key,
+        )
+        if isinstance(command, nodes.Expr):
+            if command.resolve_key == resolve_key:
+                self.eval_cache_hits += 1
+                return command.code
+            self.eval_cache_misses += 1
+            command.code = compile(command.template.format(self.resolve_eval(command.tokens, slot_map)), '<eval>', command.mode)
+            command.resolve_key = resolve_key
+            return command.code
+
+        if type(command) == str:
+            key = (mode, template, command)
+        else:
+            key = (mode, template, id(command))
+        try:
+            entry = self.eval_cache[key]
+            if entry[0] is command or type(command) == str:
+                if entry[1] == resolve_key:
+                    self.eval_cache_hits += 1
+                    return entry[2]
+        except KeyError:
+            pass
+        self.eval_cache_misses += 1
+        if type(command) == str:
+            tokens = lexer.parse_eval(command)
+        else:
+            tokens = command
+        code = compile(template.format(self.resolve_eval(tokens, slot_map)), '<eval>', mode)
+        if len(self.eval_cache) >= self.EVAL_CACHE_SIZE:
+            self.eval_cache.clear()
+        self.eval_cache[key] = [command, resolve_key, code]
+        return code
 
+    def eval_cache_info(self) -> dict:
+        """ Returns status of the eval cache """
+        return {
+            'hits': self.eval_cache_hits,
+            'misses': self.eval_cache_misses,
+            'size': len(self.eval_cache),
+        }
+
+    def exec_python(self, source: str):
+        """ Runs a python code in the current frame (`python()` function)
+
+        Compiled codes are cached by the source, the least recently used one is removed when the cache is full.
+        """
+        if type(source) is not str:
+            code = source
+        else:
+            try:
+                code = self.python_cache[source]
+                self.python_cache.move_to_end(source)
+                self.python_cache_hits += 1
+            except KeyError:
+                code = compile(source, '<string>', 'exec')
+                self.python_cache_misses += 1
+                self.python_cache[source] = code
+                while len(self.python_cache) > self.PYTHON_CACHE_SIZE:
+                    self.python_cache.popitem(last=False)
+        scope = self.frames[-1].eval_scope
+        if scope is None:
+            scope = self.make_eval_scope()
+        exec(code, globals(), scope)
+
+    def python_cache_info(self) -> dict:
+        """ Returns status of the cache of `python()` codes """
+        return {
+            'hits': self.python_cache_hits,
+            'misses': self.python_cache_misses,
+            'size': len(self.python_cache),
+        }
+
+    def load_python_module(self, name: str):
+        """ Returns a python module by its name (`py_load_module`), the modules are cached """
+        try:
+            return self.python_modules[name]
+        except KeyError:
+            module = self.python_modules[name] = importlib.import_module(name)
+            return module
+
+    def eval(self, command, only_parse=False):
+        """ Runs eval on command """
         if only_parse:
-            return py_op
+            if type(command) == str:
+                command = lexer.parse_eval(command)
+            elif isinstance(command, nodes.Expr):
+                command = command.tokens
+            return self.resolve_eval(command)
 
-        for item in result:
-            if item[0] == 'v':
-                self.variable_required(item[1])
+        scope = self.frames[-1].eval_scope
+        if scope is None:
+            scope = self.make_eval_scope()
+        return eval(self.compile_eval(command), globals(), scope)
 
-        # set aliases
-        true = True
-        false = False
-        null = None
-        string = str
-        integer = int
-        array = list
+    def exec_assign(self, target, value):
+        """ Assigns the value to a target eval (for example `$obj->name` or `$list[0]`) """
+        scope = self.frames[-1].eval_scope
+        if scope is None:
+            scope = self.make_eval_scope()
+        scope = dict(scope)
+        scope['value'] = value
+        exec(self.compile_eval(target, 'exec', '{} = value'), globals(), scope)
 
-        return eval(py_op)
+    def make_eval_scope(self) -> dict:
+        """ Makes the local scope to run the compiled evals in the current frame """
+        frame = self.frames[-1]
+        scope = dict(self.eval_scope)
+        if type(frame.vars) is Locals:
+            scope['__locals__'] = frame.vars.slots
+        frame.eval_scope = scope
+        return scope
 
     def run(self, op: dict):
         """ Run once command """
+        try:
+            node = op['node']
+        except KeyError:
+            node = op['node'] = parser.make_node(op)
+        opcode = node.opcode
 
-        op_name = op['command']
-
-        if op_name == 'func':
+        if opcode == nodes.OP_FUNC:
             self.func_depth += 1
-
-        if op_name == 'endfunc':
+        elif opcode == nodes.OP_ENDFUNC:
             if self.func_depth <= 1:
                 self.run_endfunc(op)
                 self.func_depth -= 1
@@ -415,133 +792,186 @@ class Program(helpers.Helpers):
                 self.functions[self.current_func[-1]].body.append(op)
             return
 
-        if op_name == 'endclass':
-            self.run_endclass(op)
-            return
+        self.dispatch[opcode](op)
 
-        # list of commands
-        commands_dict = {
-            'func': self.run_func,
-            'goto': self.run_goto,
-            'gotoif': self.run_gotoif,
-            'try': self.run_try,
-            'endtry': self.run_endtry,
-            'namespace': self.run_namespace,
-            'ns': self.run_namespace,
-            'endnamespace': self.run_endnamespace,
-            'endns': self.run_endnamespace,
-            'use': self.run_use,
-            'class': self.run_class,
-            'endclass': self.run_endclass,
-            'return': self.run_return,
-            'while': self.run_while,
-            'endwhile': self.run_endwhile,
-            'break': self.run_break,
-            'continue': self.run_continue,
-            '@doc': self.run_atdoc,
-            'pass': None,
-            'if': None,
-            'elif': None,
-            'else': None,
-            'endif': None,
-            'end': None,
-        }
+    def run_pass(self, op: dict):
+        """ Runs `pass`, `label`, `if`... (does nothing) """
+        pass
 
-        # check op_name is a valid command
-        op_func = 0
-        try:
-            op_func = commands_dict[op_name]
-        except:
-            pass
+    def run_expr(self, op: dict):
+        """ Runs the expression node """
+        self.mem = self.eval(op['node'].expr)
 
-        # if op_name is a valid command, run the function
-        if op_func != 0:
-            if op_func != None:
-                op_func(op)
-            return
+    def run_assign(self, op: dict):
+        """ Runs the assignment node """
+        node = op['node']
+        if node.value is None:
+            value = None
+        else:
+            value = self.eval(node.value)
+        if node.kind == 'attr' or node.kind == 'python':
+            self.exec_assign(node.target, value)
+        elif self.current_class:
+            # if a class is started, set the value as a property of class
+            self.classes[self.current_class[-1]].__props__[node.name] = value
+        elif node.kind == 'item':
+            self.exec_assign(node.target, value)
+        else:
+            self.assign_var(node.name, value)
 
-        if op['str'][0] == '$':
-            # if a class is started, append current command as a property to class
-            is_in_class = False
-            if self.current_class:
-                is_in_class = True
-            parts = parser.split_by_equals(op['strings'])
-            if len(parts) <= 1:
-                if '->' in op['str'] or '(' in op['str'] or ')' in op['str']:
-                    self.mem = self.eval(op['eval'])
-                    return
-            varname = parts[0].strip()
-            full_varname = varname
-            varname = varname.split('->', 1)
-            is_class_setting = False
-            if len(varname) > 1:
-                is_class_setting = varname[1].replace('->', '.')
-            varname = varname[0]
-            if len(parts) <= 1:
-                if is_in_class:
-                    self.classes[self.current_class[-1]].__props__[varname[1:]] = None
-                else:
-                    self.set_var(varname[1:], None)
+    def assign_var(self, name: str, value):
+        """ Sets value of a variable of the current frame (slot of the local variables if there is) """
+        frame_vars = self.frames[-1].vars
+        if type(frame_vars) is Locals and not self.namespaces_tree:
+            # local variable of the function
+            index = frame_vars.slot_map.get(name)
+            if index is not None:
+                frame_vars.slots[index] = value
                 return
-            value = None
-            if True:
-                value = self.eval(parts[1].strip())
-            if is_class_setting != False:
-                is_class_setting = self.eval('->' + is_class_setting, only_parse=True)[1:]
-                tmp_real_var = self.eval(varname)
-                exec('tmp_real_var.' + is_class_setting + ' = value')
-            else:
-                if is_in_class:
-                    self.classes[self.current_class[-1]].__props__[varname[1:]] = value
-                else:
-                    if '[' in varname or ']' in varname:
-                        the_target = self.eval(varname, only_parse=True)
-                        exec(the_target + ' = value')
-                    else:
-                        self.set_var(varname[1:], value)
-            return
+        self.set_var(name, value)
+
+    def run_increment(self, op: dict):
+        """ Runs `$<name> = $<name> + <number>` without evaluating the expression """
+        node = op['node']
+        if self.current_class:
+            return self.run_assign(op)
+        frame_vars = self.frames[-1].vars
+        if type(frame_vars) is Locals and not self.namespaces_tree:
+            index = frame_vars.slot_map.get(node.name)
+            if index is not None:
+                value = frame_vars.slots[index]
+                if value is not UNSET:
+                    frame_vars.slots[index] = value + node.step
+                    return
+        self.set_var(node.name, self.get_var(node.name) + node.step)
+
+    def run_invoke(self, op: dict):
+        """ Runs the call of a function by its name (`nodes.Invoke`)
 
-        parts = parser.split_by_equals(op['strings'])
-        if len(parts) > 1:
-            part1 = self.eval(parts[0], only_parse=True)
-            part2 = self.eval(parts[1], only_parse=True)
-            exec(part1 + ' = ' + part2)
+        If the name is a Pashmak function, the frame of the call is pushed and the loop of `run_frame` runs that,
+        then deep recursions do not nest the python calls.
+        Other callables (python functions, classes, methods...) are run like the base node.
+        """
+        node = op['node']
+        func = self.invoke_target(node)
+        if func is None:
+            return self.dispatch[node.base_opcode](op)
+        tail_call = node.opcode == nodes.OP_INVOKE_RETURN and self.is_tail_frame(self.frames[-1], func)
+        if len(self.frames) >= self.MAX_DEPTH and not tail_call:
+            raise RecursionError()
+        args, kwargs = self.eval(node.arguments)
+        memo_key = None
+        if func.memo is not None:
+            memo_key = func.memo.key(args, kwargs)
+            if memo_key is not None:
+                value = func.memo.get(memo_key)
+                if value is not MISSING:
+                    self.invoke_result(op, value)
+                    return
+        default_vars = func.bind_call(self, args, kwargs)
+        if default_vars is None:
             return
+        if tail_call:
+            # the frame of the caller is reused, the called function returns to the caller of the caller
+            frame = self.frames[-1]
+            op = frame.invoke[0]
+            frame.rebind(func.body, self.frame_vars(func.body, frame.vars, default_vars, func.slot_map))
+            frame.tail_calls += 1
+            if func.namespace:
+                frame.used_namespaces.append(func.namespace)
+                self.reset_var_keys()
+        else:
+            self.push_frame(func.body, True, default_vars, func.namespace, func.slot_map)
+            frame = self.frames[-1]
+        native_code = None
+        if not self.namespaces_tree:
+            native_code = native.get_native(self, func)
+        if native_code is not None:
+            frame.invoke = None
+            self.run_native(native_code)
+            self.end_invoke(op, func, memo_key)
+            return
+        # `run_frame` goes to the next step (the first operation)
+        frame.current_step = -1
+        frame.invoke = (op, func, memo_key)
+
+    def is_tail_frame(self, frame: Frame, func: Function) -> bool:
+        """ Checks a `return f(...)` in the frame can reuse the frame for the call of `func` (tail call)
+
+        The frame should be a call that is started by `run_invoke` and its function should not have a return type
+        or a pending memoized result (the returned value of the called function is returned to the caller of the frame directly).
+        A `try` that is opened in the frame keeps the frame too.
+        The functions that change or read the frame of their caller (`Function.uses_caller_frame`) always get a new frame.
+        """
+        if not self.tail_calls or frame.invoke is None or func.uses_caller_frame:
+            return False
+        if frame.invoke[1].binder.return_checker is not None or frame.invoke[2] is not None:
+            return False
+        for try_frame, step in self.try_endtry:
+            if try_frame is frame:
+                return False
+        return True
+
+    def invoke_target(self, node):
+        """ Returns the Pashmak function that a `nodes.Invoke` node calls, or None if it should be run like the base node
+
+        The result is cached on the node until name resolution changes.
+        """
+        if self.current_class:
+            # values of a class body are properties of the class
+            return None
+        frame_key = self.frame_resolve_key()
+        resolved = node.resolved
+        if resolved is not None and resolved[0] == self.functions.version and resolved[1] == frame_key:
+            func = resolved[2]
+        else:
+            func = None
+            real_name = self.get_func_real_name(node.function)
+            if real_name != False:
+                func = self.functions[real_name]
+                if type(func) is not Function or func.name in Function.BUILTIN_WITHOUT_FRAME_ISOLATION_FUNCTIONS \
+                        or 'parent_object' in func.__dict__:
+                    func = None
+            node.resolved = (self.functions.version, frame_key, func)
+        return func
+
+    def end_invoke(self, op: dict, func: Function, memo_key=None):
+        """ Uses the returned value of a finished call that is started by `run_invoke` in the caller frame """
+        self.invoke_result(op, func.return_value(self, memo_key))
 
+    def invoke_result(self, op: dict, value):
+        """ Assigns, returns or puts in mem the returned value of a `Invoke` node (by type of the node) """
+        node = op['node']
+        if node.opcode == nodes.OP_INVOKE_ASSIGN:
+            self.assign_var(node.name, value)
+        elif node.opcode == nodes.OP_INVOKE_RETURN:
+            self.return_frame(value)
+        else:
+            self.mem = value
+
+    def run_call(self, op: dict):
+        """ Runs the function call node """
+        node = op['node']
         # check function exists
-        func_real_name = self.get_func_real_name(op_name)
+        func_real_name = self.get_func_real_name(node.name)
         if func_real_name == False:
-            self.mem = self.eval(op['eval'])
+            self.mem = self.eval(node.expr)
             return
-        func_body = self.functions[func_real_name]
 
-        # run function
-        try:
-            # execute function body
-            if op_name in Function.BUILTIN_WITHOUT_FRAME_ISOLATION_FUNCTIONS:
-                # put argument in the mem
-                if op['args_str'] != '' and op['args_str'].strip() != '()':
-                    if op['command'] == 'rmem':
-                        self.eval(op['args_eval'])
-                        return
-                    else:
-                        func_arg = self.eval(op['args_eval'])
+        if node.name in Function.BUILTIN_WITHOUT_FRAME_ISOLATION_FUNCTIONS:
+            # put argument in the mem
+            if node.has_args:
+                if node.name == 'rmem':
+                    self.eval(node.args)
+                    return
                 else:
-                    func_arg = None
-                self.mem = func_arg
-                self.exec_func(func_body.body, False)
+                    func_arg = self.eval(node.args)
             else:
-                args_str = op['args_str'].strip()
-                if args_str:
-                    if args_str[0] != '(':
-                        args_str = '(' + args_str + ')'
-                else:
-                    args_str = '()'
-
-                self.mem = self.eval(op['command'] + args_str)
-            return
-        except Exception as ex:
-            raise
+                func_arg = None
+            self.mem = func_arg
+            self.exec_func(self.functions[func_real_name].body, False)
+        else:
+            self.mem = self.eval(node.call)
 
     def bootstrap_modules(self):
         """ Loads modules from module paths in environment variable """
@@ -556,44 +986,60 @@ class Program(helpers.Helpers):
         paths = [path.strip() for path in paths if path.strip() != '']
         self.module_path = paths
 
+    def exception_message(self, ex: Exception) -> str:
+        """ Returns message of a python exception that is raised while running the code """
+        if ex.__class__.__name__ == 'RecursionError':
+            return 'maximum recursion depth ' + str(len(self.frames)) + ' exceeded'
+        return str(ex)
+
     def start_frame(self):
         """ Start running last frame """
-        is_in_func = False
-        self.frames[-1]['current_step'] = 0
-
-        # load the labels
-        i = 0
-        while i < len(self.frames[-1]['commands']):
-            current_op = self.frames[-1]['commands'][i]
-            if current_op['command'] == 'label':
-                if not is_in_func:
-                    arg = current_op['args'][0]
-                    self.labels[arg] = i+1
-                    self.frames[-1]['commands'][i] = parser.parse('pass', filepath='<system>')[0]
-            elif current_op['command'] == 'func':
-                is_in_func = True
-            elif current_op['command'] == 'endfunc':
-                is_in_func = False
-            i += 1
-
-        while self.frames[-1]['current_step'] < len(self.frames[-1]['commands']):
+        self.frames[-1].current_step = 0
+        self.run_frame()
+
+    def run_frame(self):
+        """ Runs the last frame from the current step
+
+        The frames of the calls that are started by `run_invoke` are run by this loop too,
+        when one of them is finished, the caller continues (see `end_invoke`).
+        If a error is handled by a `try` of a outer frame, `HandledError` is raised to the `run_frame` of that frame.
+        """
+        base = len(self.frames) - 1
+        owner = self.frames[base]
+        while True:
+            frame = self.frames[-1]
             try:
-                self.run(self.frames[-1]['commands'][self.frames[-1]['current_step']])
+                if frame.current_step >= len(frame.commands):
+                    if frame.invoke is None:
+                        break
+                    self.frames.pop()
+                    self.end_invoke(*frame.invoke)
+                else:
+                    op = frame.commands[frame.current_step]
+                    node = op.get('node')
+                    if node is None or self.current_func or node.opcode <= nodes.OP_ENDFUNC:
+                        self.run(op)
+                    else:
+                        # fast path: run the opcode handler directly
+                        self.dispatch[node.opcode](op)
+            except HandledError:
+                if len(self.frames) <= base or self.frames[base] is not owner:
+                    raise
             except Exception as ex:
                 try:
-                    self.frames[-1]['commands'][self.frames[-1]['current_step']]
+                    self.frames[-1].commands[self.frames[-1].current_step]
                 except:
                     break
-                if ex.__class__.__name__ == 'RecursionError':
-                    msg = 'maximum recursion depth ' + str(len(self.frames)) + ' exceeded'
-                else:
-                    msg = str(ex)
-                self.raise_error(
-                    ex.__class__.__name__,
-                    msg,
-                    self.frames[-1]['commands'][self.frames[-1]['current_step']]
-                )
-            self.frames[-1]['current_step'] += 1
+                try:
+                    self.raise_error(
+                        ex.__class__.__name__,
+                        self.exception_message(ex),
+                        self.frames[-1].commands[self.frames[-1].current_step]
+                    )
+                except HandledError:
+                    if len(self.frames) <= base or self.frames[base] is not owner:
+                        raise
+            self.frames[-1].current_step += 1
 
         if len(self.frames) > 1:
             self.frames.pop()
@@ -601,6 +1047,33 @@ class Program(helpers.Helpers):
             # run shutdown events
             self.run_shutdown_events()
 
+    def run_native(self, native_code):
+        """ Runs the last frame by a function compiled by the native tier
+
+        If a error is raised, the error is handled like the interpreter
+        and the interpreter continues running from where the error is handled.
+        """
+        frame = self.frames[-1]
+        frame.current_step = 0
+        try:
+            native_code(self, frame, frame.commands)
+        except HandledError:
+            if self.frames[-1] is not frame:
+                raise
+            self.frames[-1].current_step += 1
+            self.run_frame()
+            return
+        except Exception as ex:
+            self.raise_error(ex.__class__.__name__, self.exception_message(ex), frame.commands[frame.current_step])
+            self.frames[-1].current_step += 1
+            self.run_frame()
+            return
+        if self.frames[-1] is frame:
+            self.frames.pop()
+        else:
+            # frames are changed by a error in a called function
+            self.run_frame()
+
     def start(self):
         """ Start running the program """
 
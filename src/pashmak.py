@@ -26,7 +26,7 @@
 import sys
 import os
 import signal
-from core import program, version, jit, parser
+from core import program, version, jit, parser, native
 
 def signal_handler(signal_code, frame):
     """ handle signal """
@@ -60,6 +60,18 @@ def main():
         print(version.version)
         sys.exit(0)
 
+    if sys.argv[1] == '--emit-py':
+        # show python code that native tier generates for functions of the file
+        if len(sys.argv) <= 2 or not os.path.isfile(sys.argv[2]):
+            print(sys.argv[0] + ': `--emit-py` option requires a script file: --emit-py [filename]')
+            sys.exit(1)
+        script_commands = parser.parse(open(sys.argv[2]).read(), filepath=sys.argv[2])
+        prog = program.Program(args=sys.argv[2:])
+        prog.main_filename = sys.argv[2]
+        prog.set_commands(script_commands)
+        print(native.emit(prog, script_commands), end='')
+        sys.exit(0)
+
     is_module_run = False
     if sys.argv[1][0] == '@':
         module_name = sys.argv[1]